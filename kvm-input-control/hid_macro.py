@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Record and replay HID input macros for zerohidserver.
+
+Recording (server side):
+  python zerohidserver.py --record bios_walkthrough.macro.gz
+
+  Every event the server executes is appended with a monotonic timestamp. Send
+  {"type": "SESSION", "action": "MARK", "name": "..."} to drop a sync point into
+  the recording (e.g. "wait until the BIOS menu is up").
+
+Replay (client side):
+  python hid_macro.py replay bios_walkthrough.macro.gz --url ws://raspberrypi.local:5000
+  python hid_macro.py replay bios_walkthrough.macro.gz --speed 4      # 4x faster
+  python hid_macro.py replay bios_walkthrough.macro.gz --speed 0      # as fast as the server accepts
+  python hid_macro.py info bios_walkthrough.macro.gz
+
+File format: one compact JSON object per line (gzip if the name ends in .gz)
+  {"macro":1,"started":"2025-01-01T12:00:00"}   header
+  {"t":1.234,"e":{...payload...}}                event, t = seconds since recording start
+  {"t":5.0,"sync":"bios menu"}                   sync point
+Files are read line by line, so replay memory does not grow with recording length.
+"""
+
+import argparse
+import asyncio
+import gzip
+import itertools
+import json
+import time
+from datetime import datetime
+
+MACRO_VERSION = 1
+
+
+def open_macro(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class MacroRecorder:
+    """Appends executed events to a macro file with monotonic timestamps."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open_macro(path, "w")
+        self.start = time.monotonic()
+        self.count = 0
+        self._write({"macro": MACRO_VERSION, "started": datetime.now().isoformat(timespec="seconds")})
+
+    def _write(self, entry):
+        self.file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def _elapsed(self):
+        return round(time.monotonic() - self.start, 4)
+
+    def record(self, payload):
+        event = {k: v for k, v in payload.items() if k != "id"}
+        self._write({"t": self._elapsed(), "e": event})
+        self.count += 1
+        # Keep the file usable if the server is killed mid-recording
+        if self.count % 50 == 0:
+            self.file.flush()
+
+    def mark(self, name=None):
+        self._write({"t": self._elapsed(), "sync": name or f"sync {self.count}"})
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+        print(f"Recorded {self.count} events to {self.path}")
+
+
+def read_macro(path):
+    """Yield entries one by one, skipping the header."""
+    with open_macro(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if "macro" in entry:
+                if entry["macro"] > MACRO_VERSION:
+                    raise ValueError(f"{path} is macro version {entry['macro']}, this tool reads {MACRO_VERSION}")
+                continue
+            yield entry
+
+
+class Replayer:
+    """
+    Streams a macro to zerohidserver.
+
+    speed > 0 keeps the recorded timing scaled by `speed`; speed == 0 sends as fast as
+    the server accepts, limited by `window` unconfirmed events and `rate` events/sec
+    (keep `rate` under the server's --rate-limit so nothing is dropped).
+    """
+
+    RETRY_ERRORS = ("ERROR: Rate limited", "ERROR: Queue full")
+
+    def __init__(self, ws, speed=1.0, window=8, rate=100, sync_every=0):
+        self.ws = ws
+        self.speed = speed
+        self.window = asyncio.Semaphore(window)
+        self.rate = rate
+        self.sync_every = sync_every
+        self.ids = itertools.count(1)
+        self.in_flight = {}
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.reader = None
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    async def _read_replies(self):
+        async for message in self.ws:
+            try:
+                reply = json.loads(message)
+            except ValueError:
+                continue
+            if not isinstance(reply, dict) or reply.get("id") not in self.in_flight:
+                continue
+            event = self.in_flight.pop(reply["id"])
+            result = reply.get("result")
+            if isinstance(result, str) and result.startswith(self.RETRY_ERRORS):
+                # Resend after a short back-off, before anything else is released
+                self.retried += 1
+                await asyncio.sleep(1.0 / max(self.rate, 1))
+                await self._send(event, acquire=False)
+                continue
+            if isinstance(result, str) and result.startswith("ERROR"):
+                self.failed += 1
+                print(f"Event failed: {event} -> {result}")
+            self.window.release()
+            if not self.in_flight:
+                self.idle.set()
+
+    async def _until_reader_stops(self, awaitable):
+        """Await awaitable, but fail instead of hanging if the reply reader stops first."""
+        waiter = asyncio.ensure_future(awaitable)
+        await asyncio.wait({waiter, self.reader}, return_when=asyncio.FIRST_COMPLETED)
+        if waiter.done():
+            return waiter.result()
+        waiter.cancel()
+        self.reader.result()  # Re-raises whatever stopped the reader
+        raise ConnectionError(f"Server closed the connection with {len(self.in_flight)} events unconfirmed")
+
+    async def _send(self, event, acquire=True):
+        if acquire:
+            await self._until_reader_stops(self.window.acquire())
+        request_id = next(self.ids)
+        self.in_flight[request_id] = event
+        self.idle.clear()
+        await self.ws.send(json.dumps(dict(event, id=request_id)))
+
+    async def sync(self):
+        """Wait until the server has confirmed every event sent so far."""
+        await self._until_reader_stops(self.idle.wait())
+
+    async def run(self, entries):
+        self.reader = asyncio.ensure_future(self._read_replies())
+        start = time.monotonic()
+        offset = 0.0  # Time spent waiting on sync points, shifts the rest of the timeline
+        last_send = 0.0
+        try:
+            for entry in entries:
+                if "sync" in entry:
+                    waited = time.monotonic()
+                    await self.sync()
+                    print(f"Sync point reached: {entry['sync']}")
+                    offset += time.monotonic() - waited
+                    continue
+
+                if self.speed > 0:
+                    due = start + offset + entry["t"] / self.speed
+                    delay = due - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                elif self.rate:
+                    delay = last_send + 1.0 / self.rate - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    last_send = time.monotonic()
+
+                await self._send(entry["e"])
+                self.sent += 1
+                if self.sync_every and self.sent % self.sync_every == 0:
+                    await self.sync()
+            await self.sync()
+        finally:
+            self.reader.cancel()
+        return time.monotonic() - start
+
+
+async def replay(path, url, speed, window, rate, sync_every, takeover):
+    import websockets
+    async with websockets.connect(url) as ws:
+        if takeover:
+            await ws.send(json.dumps({"type": "SESSION", "action": "TAKEOVER"}))
+        replayer = Replayer(ws, speed=speed, window=window, rate=rate, sync_every=sync_every)
+        elapsed = await replayer.run(read_macro(path))
+    print(f"Replayed {replayer.sent} events in {elapsed:.2f}s "
+          f"({replayer.retried} retried, {replayer.failed} failed)")
+
+
+def info(path):
+    events = syncs = 0
+    duration = 0.0
+    for entry in read_macro(path):
+        duration = entry["t"]
+        if "sync" in entry:
+            syncs += 1
+        else:
+            events += 1
+    print(f"{path}: {events} events, {syncs} sync points, {duration:.2f}s recorded")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay or inspect HID macros")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    play = sub.add_parser("replay", help="Replay a macro against zerohidserver")
+    play.add_argument("file")
+    play.add_argument("--url", default="ws://raspberrypi.local:5000", help="zerohidserver WebSocket URL")
+    play.add_argument("--speed", type=float, default=1.0,
+                      help="1 = original timing, 2 = twice as fast, 0 = as fast as the server accepts")
+    play.add_argument("--window", type=int, default=8, help="Max unconfirmed events in flight")
+    play.add_argument("--rate", type=float, default=100, help="Max events/sec when --speed 0")
+    play.add_argument("--sync-every", type=int, default=0,
+                      help="Also wait for delivery confirmation every N events")
+    play.add_argument("--no-takeover", action="store_true", help="Don't take control of the session first")
+
+    show = sub.add_parser("info", help="Summarize a macro file")
+    show.add_argument("file")
+
+    args = parser.parse_args()
+    if args.command == "replay":
+        asyncio.run(replay(args.file, args.url, args.speed, args.window, args.rate,
+                           args.sync_every, not args.no_takeover))
+    else:
+        info(args.file)
@@ -4,11 +4,25 @@ import websockets
 import json
 from zero_hid import Mouse, Keyboard, KeyCodes
 import argparse
+import itertools
+import time
+from collections import deque
+from hid_macro import MacroRecorder
 
 mouse = Mouse()
 keyboard = Keyboard()
 debug = False
 
+# --- Session / arbitration settings ---
+RATE_LIMIT = 120  # Max input events per second per client
+RATE_BURST = 40  # Events a client may send back-to-back before being throttled
+SESSION_RATE_LIMIT = 5  # Max SESSION requests (TAKEOVER, STATUS...) per second per client, each gets a metrics reply
+SESSION_BURST = 10
+QUEUE_SIZE = 32  # Max pending events per client, bounds the controller's input latency
+OUTBOX_SIZE = 64  # Max unsent replies per client, further replies are dropped until it reads
+shared_control = False  # When True every client may write, served round-robin
+recorder = None  # MacroRecorder when started with --record
+
 def to_int(val):
         if isinstance(val, int):
             return val
@@ -68,48 +82,272 @@ def mouse_handler(payload):
 
 
 
-async def handler(websocket):
-    print("Client connected")
-    try:
-        async for message in websocket:
+class TokenBucket:
+    """Allows `rate` events per second with bursts of up to `burst` events."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class ClientSession:
+    """One connected websocket client and its pending input events."""
+
+    def __init__(self, websocket, client_id):
+        self.websocket = websocket
+        self.id = client_id
+        self.queue = deque()
+        self.outbox = deque()
+        self.sender = None
+        self.bucket = TokenBucket(RATE_LIMIT, RATE_BURST)
+        self.session_bucket = TokenBucket(SESSION_RATE_LIMIT, SESSION_BURST)
+        self.stats = {
+            "received": 0,
+            "executed": 0,
+            "dropped_rate_limit": 0,
+            "dropped_queue_full": 0,
+            "rejected_observer": 0,
+            "dropped_replies": 0,
+        }
+
+    def send(self, message):
+        """
+        Queue a reply without making the caller wait on a slow client. A client that
+        stops reading only costs OUTBOX_SIZE messages, the rest are dropped.
+        """
+        if len(self.outbox) >= OUTBOX_SIZE:
+            self.stats["dropped_replies"] += 1
+            return
+        self.outbox.append(message)
+        if self.sender is None or self.sender.done():
+            self.sender = asyncio.ensure_future(self._drain_outbox())
+
+    async def _drain_outbox(self):
+        try:
+            while self.outbox:
+                await self.websocket.send(self.outbox.popleft())
+        except websockets.exceptions.ConnectionClosed:
+            self.outbox.clear()
+
+    def reply(self, payload, message):
+        """Reply to a payload, echoing its "id" so pipelining clients can match it up."""
+        if isinstance(payload, dict) and "id" in payload:
+            message = {"id": payload["id"], "result": message}
+        self.send(message if isinstance(message, str) else json.dumps(message))
+
+    def metrics(self):
+        return dict(self.stats, id=self.id, queued=len(self.queue), unsent=len(self.outbox))
+
+
+class InputArbiter:
+    """
+    Serializes input from every client onto the single HID gadget.
+
+    One client is the controller, everyone else is an observer until they take over
+    (or everyone writes when shared_control is on). A single writer task drains the
+    per-client queues: the controller is always served first, the remaining clients
+    round-robin, so the operator's latency stays bounded by its own QUEUE_SIZE.
+    """
+
+    def __init__(self):
+        self.sessions = {}
+        self.controller = None
+        self.round_robin = deque()
+        self.pending = asyncio.Event()
+        self.ids = itertools.count(1)
+
+    def join(self, websocket):
+        session = ClientSession(websocket, next(self.ids))
+        self.sessions[session.id] = session
+        self.round_robin.append(session)
+        if self.controller is None:
+            self.set_controller(session)
+        else:
+            session.send(self.role_message(session))
+        return session
+
+    def leave(self, session):
+        self.sessions.pop(session.id, None)
+        if session in self.round_robin:
+            self.round_robin.remove(session)
+        session.queue.clear()
+        session.outbox.clear()
+        if self.controller is session:
+            # Hand control to the longest connected client, if any
+            self.set_controller(self.round_robin[0] if self.round_robin else None)
+
+    def set_controller(self, session):
+        if self.controller is not session and self.controller and not shared_control:
+            # Don't replay the old controller's backlog whenever it gets control back
+            while self.controller.queue:
+                self.controller.reply(self.controller.queue.popleft(), "ERROR: Control taken over")
+        self.controller = session
+        controller_id = session.id if session else None
+        print(f"Controller is now client {controller_id}")
+        for other in self.sessions.values():
+            other.send(self.role_message(other))
+
+    def role_message(self, session):
+        controller_id = self.controller.id if self.controller else None
+        return json.dumps({"type": "SESSION", "controller": controller_id, "you": session.id,
+                           "shared": shared_control})
+
+    def can_write(self, session):
+        return shared_control or session is self.controller
+
+    def submit(self, session, payload):
+        """Queue an input event. Returns an error string if the event was dropped."""
+        session.stats["received"] += 1
+        if not self.can_write(session):
+            session.stats["rejected_observer"] += 1
+            return "ERROR: Observer, send TAKEOVER to control"
+        if not session.bucket.take():
+            session.stats["dropped_rate_limit"] += 1
+            return "ERROR: Rate limited"
+        if len(session.queue) >= QUEUE_SIZE:
+            session.stats["dropped_queue_full"] += 1
+            return "ERROR: Queue full"
+        session.queue.append(payload)
+        self.pending.set()
+        return None
+
+    def next_event(self):
+        """Pick the next (session, payload) to run, controller first then round-robin."""
+        if self.controller and self.controller.queue:
+            return self.controller, self.controller.queue.popleft()
+        for _ in range(len(self.round_robin)):
+            session = self.round_robin[0]
+            self.round_robin.rotate(-1)
+            if session.queue and self.can_write(session):
+                return session, session.queue.popleft()
+        return None, None
+
+    def metrics(self, session):
+        return {
+            "type": "SESSION",
+            "controller": self.controller.id if self.controller else None,
+            "you": session.id,
+            "shared": shared_control,
+            "clients": [s.metrics() for s in self.sessions.values()],
+        }
+
+    async def run(self):
+        """The single writer: the only place that touches the mouse/keyboard gadgets."""
+        while True:
+            await self.pending.wait()
+            session, payload = self.next_event()
+            if session is None:
+                self.pending.clear()
+                continue
             try:
                 return_message = "OK"
-                payload = json.loads(message)
-                print("Received payload:", payload)
-
                 if payload["type"] == "KEYBOARD":
                     if debug:
                         await asyncio.sleep(1)
-
-                    # keyboard.press(mods=[], key_code=0x04)
                     return_message = keyboard_handler(payload)
                     print(return_message)
-
                 elif payload["type"] == "MOUSE":
                     if debug:
                         await asyncio.sleep(0.1)
                     mouse_handler(payload)
+                session.stats["executed"] += 1
+                if recorder:
+                    recorder.record(payload)
+            except Exception as e:
+                print("Failed to send input:", e)
+                return_message = f"ERROR: {e}"
+            session.reply(payload, return_message)
+            # Let other clients' reads run between events
+            await asyncio.sleep(0)
+
+
+arbiter = None
+
 
-                await websocket.send(return_message)
+def session_handler(session, payload):
+    if not session.session_bucket.take():
+        session.stats["dropped_rate_limit"] += 1
+        return "ERROR: Rate limited"
+    action = payload.get("action")
+    if action == "TAKEOVER":
+        arbiter.set_controller(session)
+    elif action == "RELEASE" and arbiter.controller is session:
+        others = [s for s in arbiter.round_robin if s is not session]
+        arbiter.set_controller(others[0] if others else None)
+    elif action == "MARK" and recorder:
+        recorder.mark(payload.get("name"))
+    return arbiter.metrics(session)
+
+
+async def handler(websocket):
+    session = arbiter.join(websocket)
+    print(f"Client {session.id} connected")
+    try:
+        async for message in websocket:
+            try:
+                payload = json.loads(message)
+                print("Received payload:", payload)
+
+                if payload["type"] == "SESSION":
+                    session.reply(payload, session_handler(session, payload))
+                    continue
+
+                error = arbiter.submit(session, payload)
+                if error:
+                    session.reply(payload, error)
 
             except json.JSONDecodeError:
                 print("Invalid JSON:", message)
                 await websocket.send("ERROR: Invalid JSON")
 
     except websockets.exceptions.ConnectionClosed:
-        print("Client disconnected")
+        pass
+    finally:
+        arbiter.leave(session)
+        print(f"Client {session.id} disconnected")
 
 
 async def main():
-    async with websockets.serve(handler, "0.0.0.0", 5000):
-        print("WebSocket server running on ws://0.0.0.0:5000")
-        await asyncio.Future()  # run forever
+    global arbiter
+    arbiter = InputArbiter()
+    writer = asyncio.create_task(arbiter.run())
+    try:
+        async with websockets.serve(handler, "0.0.0.0", 5000):
+            print("WebSocket server running on ws://0.0.0.0:5000")
+            await asyncio.Future()  # run forever
+    finally:
+        writer.cancel()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--debug", action="store_true",
                         help="Enable 1s artificial delay on KEYBOARD actions")
+    parser.add_argument("--shared", action="store_true",
+                        help="Let every client send input instead of a single controller")
+    parser.add_argument("--rate-limit", type=float, default=RATE_LIMIT,
+                        help="Max input events per second per client")
+    parser.add_argument("--record", metavar="FILE",
+                        help="Record executed events to a macro file (see hid_macro.py)")
     args = parser.parse_args()
     debug = args.debug
-    asyncio.run(main())
+    shared_control = args.shared
+    RATE_LIMIT = args.rate_limit
+    if args.record:
+        recorder = MacroRecorder(args.record)
+    try:
+        asyncio.run(main())
+    finally:
+        if recorder:
+            recorder.close()
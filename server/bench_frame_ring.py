@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Compare the in-process capture pipeline with the out-of-process worker + shared memory ring.
+
+Runs the synthetic test pattern (or a real device with --camera) and N viewer threads
+that consume the MJPEG generator like Flask serving threads do, then reports the
+frames per second captured and the frames per second each viewer actually received.
+The worker only helps with more than one core (e.g. a Raspberry Pi 4/5).
+
+Usage examples:
+  python bench_frame_ring.py
+  python bench_frame_ring.py --viewers 1 4 8 16 --resolution 1920x1080 --fps 60 --viewer-work 3
+  python bench_frame_ring.py --camera 0 --duration 20
+"""
+
+import argparse
+import threading
+import time
+
+from capture_pipeline import CapturePipeline, ProcessCapturePipeline, SYNTHETIC_CAMERA
+
+
+def busy(ms):
+    """Pure Python work holding the GIL, standing in for per-request overhead in Flask."""
+    end = time.perf_counter() + ms / 1000.0
+    while time.perf_counter() < end:
+        pass
+
+
+def run(pipeline_class, camera, viewers, duration, resolution, fps, quality, viewer_work):
+    # Adaptive capture off so --fps is the rate actually measured
+    settings = {'resolution': resolution, 'flip_camera': False, 'show_text': False, 'unlocked_scaling': False,
+                'adaptive': False}
+    pipeline = pipeline_class("bench", camera, settings, target_fps=fps, jpeg_quality=quality, idle_timeout=60)
+    counts = [0] * viewers
+    stop = threading.Event()
+
+    def viewer(i):
+        frames = pipeline.generate_frames()
+        last = None
+        for chunk in frames:
+            if stop.is_set():
+                break
+            # Count each distinct frame once; the generator re-sends the latest frame on every tick
+            frame = pipeline.get_latest_frame()
+            if frame is not None and frame is not last:
+                counts[i] += 1
+                last = frame
+            busy(viewer_work)
+        frames.close()
+
+    threads = [threading.Thread(target=viewer, args=(i,), daemon=True) for i in range(viewers)]
+    for t in threads:
+        t.start()
+
+    # Let the device (or worker process) start before measuring
+    deadline = time.time() + 15
+    while pipeline.get_latest_frame() is None and time.time() < deadline:
+        time.sleep(0.05)
+    counts[:] = [0] * viewers
+    captured = pipeline.frame_count()
+    start = time.time()
+    time.sleep(duration)
+    elapsed = time.time() - start
+    received = list(counts)
+    captured = pipeline.frame_count() - captured
+    stop.set()
+    for t in threads:
+        t.join(2)
+    pipeline.close()
+    return captured / elapsed, [c / elapsed for c in received]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark in-process vs out-of-process capture")
+    parser.add_argument("--camera", default=SYNTHETIC_CAMERA, help="Device index, or 'synthetic'")
+    parser.add_argument("--viewers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--resolution", default="1280x720")
+    parser.add_argument("--fps", type=int, default=30, help="Target capture fps")
+    parser.add_argument("--quality", type=int, default=85, help="JPEG quality")
+    parser.add_argument("--viewer-work", type=float, default=2.0,
+                        help="Milliseconds of GIL-holding work per frame per viewer")
+    args = parser.parse_args()
+    camera = int(args.camera) if args.camera.isdigit() else args.camera
+
+    print(f"{args.resolution} @ {args.fps} fps target, {args.viewer_work} ms work per viewer frame")
+    print(f"{'viewers':>7} {'mode':>10} {'captured':>8} {'avg fps':>8} {'min fps':>8}")
+    for n in args.viewers:
+        for name, pipeline_class in (("in-process", CapturePipeline), ("worker", ProcessCapturePipeline)):
+            capture_rate, rates = run(pipeline_class, camera, n, args.duration, args.resolution, args.fps,
+                                      args.quality, args.viewer_work)
+            print(f"{n:>7} {name:>10} {capture_rate:>8.1f} {sum(rates) / len(rates):>8.1f} {min(rates):>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark (commands per second) for kvm_client vs. connect-per-command.
+
+Usage examples:
+  python bench_kvm_client.py --local                       # built-in loopback servers, no Pi needed
+  python bench_kvm_client.py --url tcp://raspberrypi.local:5555 --count 500 --window 16
+  python bench_kvm_client.py --url ws://raspberrypi.local:5000 --pool 2   # zerohidserver --shared only
+
+Against a real Pi use harmless commands (the default is a zero-length mouse move).
+With --pool > 1 the commands are sent unordered across the pool. zerohidserver only
+accepts input from its controlling session, so run it with --shared for that case,
+otherwise the extra connections get ERROR replies.
+
+zerohidserver rate limits each client (RATE_LIMIT, 120 events/s), so WebSocket targets
+are paced at --rate commands/s; "Rate limited" replies are counted and resent. Raise
+--rate together with the server's --rate-limit to measure more.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from kvm_client import KVMClient, KVMError
+import kvm_control_test_tcp
+
+
+async def run_local_tcp_server(port):
+    """Line server that greets once and answers every line with OK, like the Pi TCP server."""
+    async def handle(reader, writer):
+        writer.write(b"HID server ready\n")
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            writer.write(b"OK\n")
+            await writer.drain()
+        writer.close()
+    return await asyncio.start_server(handle, "127.0.0.1", port)
+
+
+async def run_local_ws_server(port):
+    """WebSocket server that answers like zerohidserver, echoing request ids."""
+    import websockets
+
+    async def handle(ws):
+        async for message in ws:
+            payload = json.loads(message)
+            await ws.send(json.dumps({"id": payload.get("id"), "result": "OK"}))
+    return await websockets.serve(handle, "127.0.0.1", port)
+
+
+def default_command(url):
+    if url.startswith("tcp://"):
+        return "MOVE 0 0"
+    return {"type": "MOUSE", "action": "MOVE", "key": "0|0"}
+
+
+async def bench_client(url, count, window, pool, rate=0):
+    """Returns (commands per second, rate limited replies). rate=0 sends as fast as the window allows."""
+    command = default_command(url)
+    interval = 1.0 / rate if rate else 0
+    next_send = 0
+    rate_limited = 0
+    async with KVMClient(url, pool_size=pool) as client:
+        semaphore = asyncio.Semaphore(window)
+
+        async def one():
+            nonlocal next_send, rate_limited
+            async with semaphore:
+                while True:
+                    if interval:
+                        now = time.perf_counter()
+                        slot = max(next_send, now)
+                        next_send = slot + interval
+                        await asyncio.sleep(slot - now)
+                    try:
+                        await client.request(command, ordered=pool == 1)
+                        return
+                    except KVMError as e:
+                        if "Rate limited" not in str(e):
+                            raise
+                        rate_limited += 1
+                        if not interval:
+                            await asyncio.sleep(0.01)  # Let the server's bucket refill
+
+        start = time.perf_counter()
+        tasks = [asyncio.ensure_future(one()) for _ in range(count)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # On failure stop the rest before the client closes under them
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        elapsed = time.perf_counter() - start
+    return count / elapsed, rate_limited
+
+
+def bench_legacy(host, port, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        kvm_control_test_tcp.send_command(host, port, "MOVE 0 0")
+    return count / (time.perf_counter() - start)
+
+
+async def main(args):
+    servers = []
+    urls = [args.url] if args.url else []
+    if args.local:
+        servers.append(await run_local_tcp_server(args.local_port))
+        servers.append(await run_local_ws_server(args.local_port + 1))
+        urls = [f"tcp://127.0.0.1:{args.local_port}", f"ws://127.0.0.1:{args.local_port + 1}"]
+
+    print(f"{'target':<32} {'window':>6} {'pool':>4} {'cmd/s':>10} {'limited':>8}")
+    for url in urls:
+        # The loopback servers have no rate limit
+        pace = args.rate if url.startswith("ws") and not args.local else 0
+        for window in sorted({1, args.window}):
+            rate, limited = await bench_client(url, args.count, window, args.pool, pace)
+            print(f"{url:<32} {window:>6} {args.pool:>4} {rate:>10.1f} {limited:>8}")
+
+        if url.startswith("tcp://") and args.legacy_count:
+            host, port = url[len("tcp://"):].rsplit(":", 1)
+            loop = asyncio.get_running_loop()
+            rate = await loop.run_in_executor(None, bench_legacy, host, int(port), args.legacy_count)
+            print(f"{'legacy send_command':<32} {1:>6} {'-':>4} {rate:>10.1f} {'-':>8}")
+
+    for server in servers:
+        server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark HID command throughput")
+    parser.add_argument("--url", help="tcp://host:port or ws://host:port")
+    parser.add_argument("--local", action="store_true", help="Benchmark against built-in loopback servers")
+    parser.add_argument("--local-port", type=int, default=5560, help="First port for --local servers")
+    parser.add_argument("--count", type=int, default=1000, help="Commands per run")
+    parser.add_argument("--window", type=int, default=32, help="Max pipelined commands in flight")
+    parser.add_argument("--rate", type=float, default=100,
+                        help="Commands/s for WebSocket targets, below zerohidserver's --rate-limit (0 = unpaced)")
+    parser.add_argument("--pool", type=int, default=1, help="Pooled connections (needs zerohidserver --shared)")
+    parser.add_argument("--legacy-count", type=int, default=3,
+                        help="Commands to time with the old connect-per-command client (0 to skip)")
+    args = parser.parse_args()
+    if not args.url and not args.local:
+        parser.error("Provide --url or --local")
+    asyncio.run(main(args))
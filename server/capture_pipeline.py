@@ -0,0 +1,916 @@
+import cv2
+import math
+import multiprocessing
+import numpy as np
+import queue
+import threading
+import time
+from queue import Queue
+
+from frame_ring import FrameRing, STATE_FAILED, STATE_RUNNING, STATE_STARTING
+from get_video_output import fourcc_to_str, update_capabilities
+
+SYNTHETIC_CAMERA = "synthetic"  # "camera" value for a generated test pattern instead of a device
+AUTO_MODE = "auto"  # "resolution" value that lets choose_mode pick from the probed capabilities
+DEFAULT_RESOLUTION = "1280x720"  # Used by auto mode until the device has been probed
+DECODE_BUDGET = 0.5  # Share of the frame interval auto mode lets decoding take, the rest is left for encoding
+# Bounds for the motion-adaptive controller, each can be overridden in config.json or on the settings page
+ADAPTIVE_DEFAULTS = {'adaptive': True, 'min_fps': 5, 'max_fps': 60, 'min_quality': 50, 'bitrate_kbps': 20000}
+
+
+def adaptive_setting(settings, key):
+    return settings.get(key, ADAPTIVE_DEFAULTS[key])
+
+
+def demand_fps(settings, target_fps):
+    """Frame rate to ask the device for: the adaptive ceiling, or the fixed target rate."""
+    if adaptive_setting(settings, 'adaptive'):
+        return adaptive_setting(settings, 'max_fps')
+    return target_fps
+
+# What each setting affects, from cheapest to most expensive to change
+PAGE_SETTINGS = ('show_text', 'unlocked_scaling', 'video_transport')  # Only the web page, nothing to do here
+RENDER_SETTINGS = ('flip_camera',)  # Applied to the next captured frame
+ENCODE_SETTINGS = ('jpeg_quality', 'min_fps', 'min_quality', 'bitrate_kbps')  # Applied at the next encode
+DEVICE_SETTINGS = ('resolution', 'adaptive', 'max_fps')  # Needs the device to renegotiate its mode
+SETTING_KINDS = (('device', DEVICE_SETTINGS), ('encode', ENCODE_SETTINGS),
+                 ('render', RENDER_SETTINGS), ('page', PAGE_SETTINGS))
+
+
+def classify_settings(old, new, jpeg_quality=85):
+    """
+    Returns (kind, changed keys) where kind is the most expensive class touched, or None.
+    A missing key counts as its default, so saving an older config.json that lacks the
+    adaptive keys doesn't look like a mode change.
+    """
+    defaults = dict(ADAPTIVE_DEFAULTS, jpeg_quality=jpeg_quality)
+    changed = sorted(k for k in set(old) | set(new) if old.get(k, defaults.get(k)) != new.get(k, defaults.get(k)))
+    for kind, keys in SETTING_KINDS:
+        if any(k in changed for k in keys):
+            return kind, changed
+    return None, changed
+
+
+class SyntheticCapture:
+    """Moving test pattern with the cv2.VideoCapture interface, for benchmarks and testing without hardware."""
+
+    def __init__(self):
+        self.props = {cv2.CAP_PROP_FRAME_WIDTH: 1280, cv2.CAP_PROP_FRAME_HEIGHT: 720, cv2.CAP_PROP_FPS: 30}
+        self.count = 0
+        self.next_frame = time.time()
+
+    def isOpened(self):
+        return True
+
+    def set(self, prop, value):
+        self.props[prop] = value
+        return True
+
+    def get(self, prop):
+        return self.props.get(prop, 0)
+
+    def read(self):
+        # Pace like a real device
+        self.next_frame += 1.0 / max(self.props[cv2.CAP_PROP_FPS], 1)
+        delay = self.next_frame - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self.next_frame = time.time()
+        width = int(self.props[cv2.CAP_PROP_FRAME_WIDTH])
+        height = int(self.props[cv2.CAP_PROP_FRAME_HEIGHT])
+        x = np.arange(width, dtype=np.uint16)
+        row = ((x + self.count * 8) % 256).astype(np.uint8)
+        frame = np.repeat(np.broadcast_to(row, (height, width))[:, :, None], 3, axis=2)
+        cv2.putText(frame, f"{self.count}", (20, 60), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 3)
+        self.count += 1
+        return True, frame
+
+    def release(self):
+        pass
+
+
+def choose_mode(settings, modes, target_fps):
+    """
+    Pick (pixel format or None, width, height, fps) to request for settings['resolution'].
+
+    modes is the device's probed capability list (get_video_output.probe_capabilities).
+    For a fixed WIDTHxHEIGHT the format that keeps up with target_fps at the lowest
+    decode cost wins. "auto" takes the largest mode that delivers target_fps with its
+    decode fitting DECODE_BUDGET of the frame interval, falling back to the fastest one.
+    The rate asked for is the lowest the mode offers at or above target_fps, so the
+    device doesn't send frames that would be dropped anyway.
+    """
+    resolution = settings.get('resolution', DEFAULT_RESOLUTION)
+
+    def keeps_up(mode):
+        return mode['measured_fps'] >= target_fps * 0.9
+
+    def fits(mode):
+        return mode['decode_ms'] <= DECODE_BUDGET * 1000.0 / target_fps
+
+    if resolution == AUTO_MODE:
+        candidates = [m for m in modes if keeps_up(m) and fits(m)]
+        if candidates:
+            mode = max(candidates, key=lambda m: (m['width'] * m['height'], m['measured_fps'], -m['decode_ms']))
+        else:
+            mode = max(modes, key=lambda m: m['measured_fps'], default=None)
+        if mode is None:
+            resolution = DEFAULT_RESOLUTION
+    else:
+        width, height = map(int, resolution.split('x'))
+        sized = [m for m in modes if m['width'] == width and m['height'] == height]
+        mode = max(sized, key=lambda m: (keeps_up(m), -m['decode_ms']), default=None)
+    if mode is None:
+        width, height = map(int, resolution.split('x'))
+        return None, width, height, target_fps
+    rates = sorted(mode.get('fps_options') or [mode['fps']])
+    fps = next((r for r in rates if r >= target_fps), rates[-1])
+    return mode['format'], mode['width'], mode['height'], fps
+
+
+def format_mode(pixel_format, width, height, fps):
+    return f"{pixel_format + ' ' if pixel_format else ''}{width}x{height}@{fps:g}"
+
+
+def request_mode(camera, pixel_format, width, height, fps):
+    """Ask the device for a mode and warn if the driver silently negotiated something else."""
+    if pixel_format:
+        camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*pixel_format))
+    camera.set(cv2.CAP_PROP_FPS, fps)
+    camera.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    camera.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    got_format = fourcc_to_str(camera.get(cv2.CAP_PROP_FOURCC)) or None
+    got = (got_format if pixel_format else pixel_format, int(camera.get(cv2.CAP_PROP_FRAME_WIDTH)),
+           int(camera.get(cv2.CAP_PROP_FRAME_HEIGHT)), camera.get(cv2.CAP_PROP_FPS))
+    if got[:3] != (pixel_format, width, height) or abs(got[3] - fps) > 0.5:
+        print(f"Warning: asked the camera for {format_mode(pixel_format, width, height, fps)}, "
+              f"it negotiated {format_mode(*got)}")
+    return got
+
+
+def open_camera(camera_index, settings, target_fps, modes=None):
+    """Opens a capture device with low latency settings. Returns None if it can't be opened."""
+    mode = choose_mode(settings, modes or [], target_fps)
+    if camera_index == SYNTHETIC_CAMERA:
+        camera = SyntheticCapture()
+    else:
+        camera = cv2.VideoCapture(camera_index)
+
+    if not camera.isOpened():
+        return None
+
+    # Optimize camera settings for low latency
+    camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Reduce internal buffer
+    request_mode(camera, *mode)
+    return camera
+
+
+def renegotiate(camera, camera_index, settings, target_fps, modes=None):
+    """
+    Switch an open device to the mode in settings. Tries set() on the running device
+    first and checks a frame actually comes back in the new size; only if the driver
+    refuses is the device closed and reopened. Returns (camera or None, method).
+    """
+    pixel_format, width, height, fps = choose_mode(settings, modes or [], target_fps)
+    if pixel_format:
+        # Some drivers only switch format on a fresh open, the frame size check below catches that
+        camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*pixel_format))
+    if camera.set(cv2.CAP_PROP_FRAME_WIDTH, width) and camera.set(cv2.CAP_PROP_FRAME_HEIGHT, height):
+        camera.set(cv2.CAP_PROP_FPS, fps)
+        ret, frame = camera.read()
+        if ret and frame.shape[1] == width and frame.shape[0] == height:
+            return camera, "in-place"
+    camera.release()
+    return open_camera(camera_index, settings, target_fps, modes), "reopen"
+
+
+def parse_roi(text):
+    """
+    Parse a region of interest "x,y,w,h" given as fractions of the frame (0-1).
+    Returns None for an empty value, raises ValueError if it is malformed or lies
+    outside the frame.
+    """
+    if not text:
+        return None
+    x, y, w, h = (float(v) for v in text.split(','))
+    if any(math.isnan(v) for v in (x, y, w, h)):
+        raise ValueError("ROI values must be numbers")
+    x = min(max(x, 0.0), 1.0)
+    y = min(max(y, 0.0), 1.0)
+    w = min(w, 1.0 - x)
+    h = min(h, 1.0 - y)
+    # Checked after clamping, "1,0,0.5,0.5" would otherwise be an empty crop
+    if not (w > 0 and h > 0):
+        raise ValueError("ROI must cover part of the frame")
+    return (x, y, w, h)
+
+
+def crop_roi(frame, roi, min_size=16):
+    """Native-resolution view of the ROI: a numpy slice of the shared frame, never a copy or upscale."""
+    height, width = frame.shape[:2]
+    x, y, w, h = roi
+    left, top = int(x * width), int(y * height)
+    right = min(max(left + min_size, int((x + w) * width)), width)
+    bottom = min(max(top + min_size, int((y + h) * height)), height)
+    # Near the right or bottom edge grow the crop back into the frame instead of shrinking it
+    left = max(min(left, right - min_size), 0)
+    top = max(min(top, bottom - min_size), 0)
+    return frame[top:bottom, left:right]
+
+
+def reconfigure_report(stream_id, kind, changed, method, downtime):
+    report = {'kind': kind, 'changed': changed, 'method': method,
+              'downtime_ms': round(downtime * 1000, 1), 'at': time.time()}
+    print(f"[{stream_id}] Settings applied ({kind}, {method}): {', '.join(changed)}"
+          f" - downtime {report['downtime_ms']} ms")
+    return report
+
+
+class AdaptiveController:
+    """
+    Motion-adaptive capture rate and JPEG quality.
+
+    Motion is measured on a sparse grid of pixels (every GRID_STEP-th in each direction),
+    which costs microseconds even at 1080p. A changing screen pushes the rate up to
+    max_fps straight away, a static one lets it decay toward min_fps with a half-life of
+    DECAY_HALF_LIFE seconds. Quality steps down while the stream is over bitrate_kbps
+    and back up to jpeg_quality once there is room again.
+    """
+
+    GRID_STEP = 16
+    PIXEL_THRESHOLD = 12  # Intensity change that counts a sample as changed, above capture card noise
+    MIN_CHANGED = 2  # Changed samples needed to count as motion
+    FULL_MOTION = 0.01  # Share of changed samples that means full speed (dragging a window, scrolling)
+    DECAY_HALF_LIFE = 0.5
+    QUALITY_DOWN = 5
+    QUALITY_UP = 2
+
+    def __init__(self, device_fps, quality):
+        self.device_fps = device_fps
+        self.fps = None
+        self.quality = quality
+        self.motion = 0.0
+        self.frame_size = None  # Smoothed encoded frame size in bytes
+        self.previous = None
+        self.last_update = None
+
+    def measure_motion(self, frame):
+        """Share of grid samples that changed since the previous frame."""
+        sample = frame[::self.GRID_STEP, ::self.GRID_STEP, 1].astype(np.int16)
+        previous, self.previous = self.previous, sample
+        if previous is None or previous.shape != sample.shape:
+            return 1.0
+        changed = int(np.count_nonzero(np.abs(sample - previous) > self.PIXEL_THRESHOLD))
+        return changed / sample.size if changed >= self.MIN_CHANGED else 0.0
+
+    def update(self, frame, settings, now=None):
+        """Feed a captured frame. Returns the interval to wait before capturing the next one."""
+        now = now or time.time()
+        min_fps = adaptive_setting(settings, 'min_fps')
+        max_fps = adaptive_setting(settings, 'max_fps')
+        if self.device_fps:
+            max_fps = min(max_fps, self.device_fps)
+        min_fps = min(min_fps, max_fps)
+        if self.fps is None:
+            self.fps = max_fps
+
+        self.motion = self.measure_motion(frame)
+        if self.motion > 0:
+            # Small changes (typing) get at least half speed, large ones full speed
+            share = min(self.motion / self.FULL_MOTION, 1.0)
+            self.fps = max(self.fps, max_fps * (0.5 + 0.5 * share))
+        elif self.last_update is not None:
+            decay = 0.5 ** ((now - self.last_update) / self.DECAY_HALF_LIFE)
+            self.fps = min_fps + (self.fps - min_fps) * decay
+        self.fps = min(max(self.fps, min_fps), max_fps)
+        self.last_update = now
+        return 1.0 / self.fps
+
+    def encoded(self, size, settings, max_quality):
+        """Feed the size of the frame just encoded, adjusting the quality for the next one."""
+        self.frame_size = size if self.frame_size is None else 0.8 * self.frame_size + 0.2 * size
+        min_quality = min(adaptive_setting(settings, 'min_quality'), max_quality)
+        budget = adaptive_setting(settings, 'bitrate_kbps')
+        if not budget:
+            self.quality = max_quality
+        elif self.kbps() > budget:
+            self.quality = max(min_quality, self.quality - self.QUALITY_DOWN)
+        elif self.kbps() < budget * 0.7:
+            self.quality = min(max_quality, self.quality + self.QUALITY_UP)
+        self.quality = min(max(self.quality, min_quality), max_quality)
+
+    def kbps(self):
+        return (self.frame_size or 0) * 8 * (self.fps or 0) / 1000.0
+
+    def state(self):
+        return {'fps': round(self.fps or 0, 1), 'quality': self.quality, 'motion': round(self.motion, 4),
+                'kbps': round(self.kbps())}
+
+
+class CapturePipeline:
+    """
+    Capture, encode and viewer state for one capture device.
+
+    The device is opened when the first viewer connects and released after
+    idle_timeout seconds without viewers. The capture thread exits with it, so an
+    idle pipeline costs nothing.
+    """
+
+    OPEN_RETRY_DELAY = 5  # Seconds before retrying a camera that failed to open
+
+    def __init__(self, stream_id, camera_index, settings, target_fps=24, jpeg_quality=85,
+                 idle_timeout=5, buffer_size=2, modes=None):
+        self.stream_id = stream_id
+        self.camera_index = camera_index
+        self.settings = settings
+        self.modes = modes or []  # Probed capabilities of the device, see choose_mode
+        self.target_fps = target_fps
+        self.jpeg_quality = jpeg_quality
+        self.idle_timeout = idle_timeout
+
+        self.camera = None
+        self.camera_lock = threading.Lock()
+        self.frame_queue = Queue(maxsize=buffer_size)
+        self.latest_frame = None
+        self.latest_frame_time = None
+        self.latest_raw = None  # Last captured frame before encoding, read (never modified) by zoomed viewers
+        self.frames_captured = 0
+        self.last_access_time = None
+        self.capture_thread = None
+        self.active_viewers = 0
+        self.viewer_lock = threading.Lock()
+        self.pending_device_settings = None  # Picked up by the capture thread
+        self.reconfiguring = None  # {'changed', 'started', 'method'} while a mode change is in progress
+        self.last_reconfigure = None
+        self.adaptive_state = None  # AdaptiveController.state() of the running capture, for the overlay
+        self.reopen_at = None  # Set when a mode change couldn't reopen the device, tick() retries then
+
+    def __repr__(self):
+        return f"<CapturePipeline {self.stream_id} camera={self.camera_index}>"
+
+    def get_latest_frame(self):
+        return self.latest_frame
+
+    def get_latest(self):
+        """(frame number, capture time, JPEG bytes) of the newest frame."""
+        return self.frames_captured, self.latest_frame_time, self.latest_frame
+
+    def get_latest_raw(self):
+        """(frame number, raw BGR frame) for viewers that crop before encoding."""
+        return self.frames_captured, self.latest_raw
+
+    def is_running(self):
+        return self.camera is not None
+
+    def frame_count(self):
+        """Frames encoded since the pipeline was created."""
+        return self.frames_captured
+
+    def update_settings(self, settings):
+        """
+        Apply new settings with the least disruption they allow. Page, render and
+        encode settings take effect on the next frame; resolution changes are
+        renegotiated by the capture thread, which records the downtime in last_reconfigure.
+        """
+        kind, changed = classify_settings(self.settings, settings, self.jpeg_quality)
+        self.settings = settings
+        if kind is None:
+            return
+        if kind == 'device':
+            with self.camera_lock:
+                if self.camera:
+                    self.reconfiguring = {'changed': changed, 'started': time.time(), 'method': None}
+                    self.pending_device_settings = settings
+                    return
+            # Not streaming: the next open simply uses the new mode
+            method = "deferred"
+        else:
+            method = "hot"
+        self.last_reconfigure = reconfigure_report(self.stream_id, kind, changed, method, 0)
+
+    def _apply_pending_device_settings(self):
+        """Runs on the capture thread with camera_lock held."""
+        settings, self.pending_device_settings = self.pending_device_settings, None
+        print(f"[{self.stream_id}] Renegotiating camera mode to {settings['resolution']}")
+        self.camera, self.reconfiguring['method'] = renegotiate(self.camera, self.camera_index, settings,
+                                                                demand_fps(settings, self.target_fps), self.modes)
+        if self.camera is None:
+            print(f"[{self.stream_id}] Error: Could not reopen camera {self.camera_index}, "
+                  f"retrying in {self.OPEN_RETRY_DELAY}s.")
+            self._clear_frames()
+            self.reopen_at = time.time() + self.OPEN_RETRY_DELAY
+
+    def _finish_reconfigure(self):
+        """First frame after a renegotiation is out: record how long viewers waited."""
+        reconfiguring, self.reconfiguring = self.reconfiguring, None
+        self.last_reconfigure = reconfigure_report(self.stream_id, 'device', reconfiguring['changed'],
+                                                   reconfiguring['method'], time.time() - reconfiguring['started'])
+
+    def status(self):
+        return {
+            'id': self.stream_id,
+            'running': self.is_running(),
+            'viewers': self.active_viewers,
+            'frames': self.frame_count(),
+            'mode': self.broadcast_resolution(),
+            'requested_mode': self.requested_mode(),
+            'reconfiguring': self.reconfiguring is not None,
+            'last_reconfigure': self.last_reconfigure,
+            'adaptive': self.adaptive_state if self.is_running() else None,
+        }
+
+    def current_fps(self):
+        """Rate frames are being produced at right now."""
+        if self.adaptive_state:
+            return self.adaptive_state['fps']
+        return self.target_fps
+
+    def requested_mode(self):
+        """The mode choose_mode asks the device for with the current settings."""
+        return format_mode(*choose_mode(self.settings, self.modes, demand_fps(self.settings, self.target_fps)))
+
+    def probe_modes(self):
+        """
+        Measure every mode the device supports and cache the result. The device has to
+        be free, so this refuses (returns None) while streaming; viewers connecting in
+        the meantime wait for it to finish.
+        """
+        if self.camera_index == SYNTHETIC_CAMERA:
+            return None
+        with self.camera_lock:
+            if self.is_running():
+                return None
+            modes = update_capabilities(self.camera_index)
+            if modes:
+                self.modes = modes
+        return modes
+
+    def tick(self):
+        """Called about once a second by the manager thread: handles idle shutdown and reopen retries."""
+        with self.viewer_lock:
+            current_viewers = self.active_viewers
+
+        thread = self.capture_thread
+        if current_viewers and self.camera and thread is not None and not thread.is_alive():
+            print(f"[{self.stream_id}] Capture thread died, restarting it.")
+            self.start()
+
+        if self.reopen_at is not None and time.time() >= self.reopen_at:
+            if not current_viewers or self.start():
+                self.reopen_at = None
+            else:
+                self.reopen_at = time.time() + self.OPEN_RETRY_DELAY
+
+        if current_viewers == 0 and self.last_access_time and (time.time() - self.last_access_time) > self.idle_timeout:
+            with self.camera_lock:
+                if self.camera:
+                    print(f"[{self.stream_id}] Stopping camera due to inactivity.")
+                    self._release()
+            self.last_access_time = None
+
+    def _release(self):
+        """Release the device and drop buffered frames. Caller holds camera_lock."""
+        self.camera.release()
+        self.camera = None
+        self._clear_frames()
+
+    def _clear_frames(self):
+        """Forget the last frames so viewers don't keep showing a stale picture."""
+        self.latest_frame = None
+        self.latest_frame_time = None
+        self.latest_raw = None
+        self.pending_device_settings = None
+        self.reconfiguring = None
+        self.adaptive_state = None
+        while not self.frame_queue.empty():
+            try:
+                self.frame_queue.get_nowait()
+            except Exception:
+                break
+
+    def capture_frames(self):
+        """
+        Frame capture loop for this device, runs until the camera is released.
+        With adaptive capture on, the interval between frames comes from the AdaptiveController.
+        """
+        frame_interval = 1.0 / self.target_fps
+        last_frame_time = 0
+        adaptive = None
+
+        while True:
+            current_time = time.time()
+
+            # Control frame rate
+            if current_time - last_frame_time < frame_interval:
+                time.sleep(0.001)  # Very short sleep to prevent CPU spinning
+                continue
+
+            with self.camera_lock:
+                if self.camera and self.pending_device_settings is not None:
+                    self._apply_pending_device_settings()
+                    adaptive = None  # The device rate may have changed
+                if not self.camera:
+                    # Released: let start() know it needs a new thread
+                    self.capture_thread = None
+                    return
+                camera = self.camera
+                ret, frame = camera.read()
+
+            if ret:
+                if self.settings['flip_camera']:
+                    frame = cv2.flip(frame, 1)
+                quality = self.settings.get('jpeg_quality', self.jpeg_quality)
+                if adaptive_setting(self.settings, 'adaptive'):
+                    if adaptive is None:
+                        adaptive = AdaptiveController(camera.get(cv2.CAP_PROP_FPS), quality)
+                    frame_interval = adaptive.update(frame, self.settings, current_time)
+                    quality = adaptive.quality
+                else:
+                    adaptive = None
+                    frame_interval = 1.0 / self.target_fps
+                # Encode frame to JPEG
+                encode_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+                _, buffer = cv2.imencode('.jpg', frame, encode_params)
+                frame_bytes = buffer.tobytes()
+                if adaptive:
+                    adaptive.encoded(len(frame_bytes), self.settings, self.settings.get('jpeg_quality', self.jpeg_quality))
+                self.adaptive_state = adaptive.state() if adaptive else None
+
+                # Update latest frame (thread-safe)
+                self.latest_raw = frame
+                self.latest_frame_time = time.time()
+                self.latest_frame = frame_bytes
+                self.frames_captured += 1
+                if self.reconfiguring and self.reconfiguring['method']:
+                    self._finish_reconfigure()
+
+                # Add to queue, removing old frames if queue is full
+                if self.frame_queue.full():
+                    try:
+                        self.frame_queue.get_nowait()  # Remove oldest frame
+                    except Exception:
+                        pass
+
+                try:
+                    self.frame_queue.put_nowait(frame_bytes)
+                except Exception:
+                    pass  # Queue might be full, skip this frame
+
+                last_frame_time = current_time
+            else:
+                print(f"[{self.stream_id}] Failed to read frame from camera.")
+                time.sleep(0.1)
+
+    def start(self):
+        """Opens the camera with low latency settings and starts the capture thread."""
+        with self.camera_lock:
+            if self.camera is None:
+                print(f"[{self.stream_id}] Initializing camera (index: {self.camera_index})...")
+                camera = open_camera(self.camera_index, self.settings, demand_fps(self.settings, self.target_fps),
+                                     self.modes)
+
+                if camera is None:
+                    print(f"[{self.stream_id}] Error: Could not open camera {self.camera_index}.")
+                    return False
+
+                self.camera = camera
+                print(f"[{self.stream_id}] Camera mode: {self.broadcast_resolution()}"
+                      f" (requested {self.requested_mode()})")
+
+                print(f"[{self.stream_id}] Camera initialized successfully.")
+
+            # Start the capture thread
+            if self.capture_thread is None or not self.capture_thread.is_alive():
+                self.capture_thread = threading.Thread(target=self.capture_frames, daemon=True)
+                self.capture_thread.start()
+
+        return True
+
+    def add_viewer(self):
+        """Count a new viewer and make sure capture is running. Returns False if the device can't be opened."""
+        with self.viewer_lock:
+            self.active_viewers += 1
+
+        if not self.start():
+            with self.viewer_lock:
+                self.active_viewers -= 1
+            return False
+
+        print(f"[{self.stream_id}] Viewer connected. Total viewers: {self.active_viewers}")
+        return True
+
+    def remove_viewer(self):
+        with self.viewer_lock:
+            self.active_viewers -= 1
+        print(f"[{self.stream_id}] Viewer disconnected. Total viewers: {self.active_viewers}")
+
+    def encode_roi(self, raw, roi):
+        quality = self.settings.get('jpeg_quality', self.jpeg_quality)
+        _, buffer = cv2.imencode('.jpg', crop_roi(raw, roi), [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return buffer.tobytes()
+
+    def generate_frames(self, roi=None):
+        """
+        Generator that yields the latest frames as a multipart MJPEG stream.
+        With a roi (see parse_roi) only that region is sent, cropped from the raw
+        frame at native resolution and encoded for this viewer alone.
+        """
+        if not self.add_viewer():
+            return
+
+        frame = None
+        last_seq = None
+        last_sent = 0
+        try:
+            while True:
+                now = self.last_access_time = time.time()
+
+                if roi:
+                    seq, raw = self.get_latest_raw()
+                    if raw is not None and seq != last_seq:
+                        frame = self.encode_roi(raw, roi)
+                else:
+                    seq = self.frame_count()
+                    frame = self.get_latest_frame()
+                # New frames go out straight away, an unchanged one is repeated at the current capture rate
+                fps = self.current_fps()
+                if frame and (seq != last_seq or now - last_sent >= 1.0 / fps):
+                    last_seq, last_sent = seq, now
+                    yield (
+                        b'--frame\r\n'
+                        b'Content-Type: image/jpeg\r\n\r\n' +
+                        frame +
+                        b'\r\n'
+                    )
+
+                # Small sleep to prevent overwhelming the client
+                time.sleep(1.0 / max(fps, self.target_fps))
+
+        except GeneratorExit:
+            # Client disconnected
+            pass
+        finally:
+            self.remove_viewer()
+
+    def close(self):
+        with self.camera_lock:
+            if self.camera:
+                self._release()
+
+    def broadcast_resolution(self):
+        """Current mode as WIDTHxHEIGHT@FPS for the info overlay."""
+        camera = self.camera
+        if not camera:
+            return "0x0@0"
+        width = int(camera.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(camera.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = camera.get(cv2.CAP_PROP_FPS)
+        return f"{width}x{height}@{fps}"
+
+
+def run_capture_worker(stream_id, ring_name, camera_index, settings, target_fps, jpeg_quality, control, reports,
+                       modes=None):
+    """
+    Entry point of the capture process: capture, flip and encode straight into the
+    shared frame ring. Exits with status 2 if the device can't be opened.
+
+    New settings arrive on `control` as (settings, requested_at). Once the first frame
+    after a mode change is published ('reconfigure', report) is put on `reports`, and
+    ('adaptive', state) about once a second while adaptive capture is on.
+    """
+    ring = FrameRing(ring_name)
+    camera = open_camera(camera_index, settings, demand_fps(settings, target_fps), modes)
+    if camera is None:
+        print(f"Capture worker: could not open camera {camera_index}.")
+        ring.set_status(STATE_FAILED)
+        ring.close()
+        raise SystemExit(2)
+
+    def publish_mode():
+        ring.set_status(STATE_RUNNING, int(camera.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                        int(camera.get(cv2.CAP_PROP_FRAME_HEIGHT)), camera.get(cv2.CAP_PROP_FPS))
+
+    publish_mode()
+    frame_interval = 1.0 / target_fps
+    last_frame_time = 0
+    reconfiguring = None
+    adaptive = None
+    last_state_report = 0
+    try:
+        while True:
+            try:
+                new_settings, requested_at = control.get_nowait()
+            except queue.Empty:
+                new_settings = None
+            if new_settings is not None:
+                kind, changed = classify_settings(settings, new_settings, jpeg_quality)
+                settings = new_settings
+                if kind == 'device':
+                    camera, method = renegotiate(camera, camera_index, settings, demand_fps(settings, target_fps),
+                                                 modes)
+                    if camera is None:
+                        print(f"Capture worker: could not reopen camera {camera_index}.")
+                        ring.set_status(STATE_FAILED)
+                        raise SystemExit(2)
+                    publish_mode()
+                    reconfiguring = {'changed': changed, 'started': requested_at, 'method': method}
+                    adaptive = None
+
+            delay = last_frame_time + frame_interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            ret, frame = camera.read()
+            if not ret:
+                print("Capture worker: failed to read frame from camera.")
+                time.sleep(0.1)
+                continue
+            last_frame_time = time.time()
+            if settings['flip_camera']:
+                frame = cv2.flip(frame, 1)
+            quality = settings.get('jpeg_quality', jpeg_quality)
+            if adaptive_setting(settings, 'adaptive'):
+                if adaptive is None:
+                    adaptive = AdaptiveController(camera.get(cv2.CAP_PROP_FPS), quality)
+                frame_interval = adaptive.update(frame, settings, last_frame_time)
+                quality = adaptive.quality
+            else:
+                adaptive = None
+                frame_interval = 1.0 / target_fps
+            encode_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+            _, buffer = cv2.imencode('.jpg', frame, encode_params)
+            if adaptive:
+                adaptive.encoded(len(buffer), settings, settings.get('jpeg_quality', jpeg_quality))
+                if last_frame_time - last_state_report >= 1:
+                    reports.put(('adaptive', adaptive.state()))
+                    last_state_report = last_frame_time
+            # The encoded buffer goes straight into shared memory, no pipe involved
+            if not ring.write(buffer.data, last_frame_time):
+                print(f"Capture worker: {len(buffer)} byte frame doesn't fit the ring slot, dropped.")
+            elif reconfiguring:
+                reports.put(('reconfigure', reconfigure_report(stream_id, 'device', reconfiguring['changed'],
+                                                               reconfiguring['method'],
+                                                               time.time() - reconfiguring['started'])))
+                reconfiguring = None
+    finally:
+        if camera is not None:
+            camera.release()
+        ring.close()
+
+
+class ProcessCapturePipeline(CapturePipeline):
+    """
+    CapturePipeline whose capture and encode run in a separate process, so they don't
+    share the GIL with the Flask serving threads. Frames come back through a shared
+    memory FrameRing; if the worker dies while people are watching it is restarted.
+    """
+
+    RESTART_DELAY = 1  # Seconds before restarting a crashed worker
+
+    def __init__(self, *args, ring_slots=4, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ring = FrameRing(slots=ring_slots, create=True)
+        self.worker = None
+        self.worker_lock = threading.Lock()
+        self.restart_at = 0
+        self.frame_cache = (0, None, None)  # (seq, bytes, capture time) of the newest frame copied out of the ring
+        self.control = None
+        self.reports = None
+        self.raw_cache = (0, None)
+
+    def get_latest_frame(self):
+        # One copy out of shared memory per new frame, shared by every viewer thread
+        cached_seq, cached, _ = self.frame_cache
+        seq, timestamp, data = self.ring.read(cached_seq)
+        if data is not None:
+            self.frame_cache = (seq, data, timestamp)
+            return data
+        return cached
+
+    def get_latest(self):
+        self.get_latest_frame()
+        seq, data, timestamp = self.frame_cache
+        return seq, timestamp, data
+
+    def get_latest_raw(self):
+        # The ring only holds encoded frames, so zoomed viewers decode the newest one
+        # (once per frame, shared between them) and crop that instead
+        self.get_latest_frame()
+        seq, data, _ = self.frame_cache
+        raw_seq, raw = self.raw_cache
+        if data is not None and seq != raw_seq:
+            raw = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+            self.raw_cache = (seq, raw)
+        return self.raw_cache
+
+    def is_running(self):
+        return self.worker is not None and self.worker.is_alive()
+
+    def frame_count(self):
+        return self.ring.latest_seq
+
+    def start(self):
+        with self.worker_lock:
+            if self.worker is None:
+                self._spawn()
+        return True
+
+    def update_settings(self, settings):
+        """Same classes as the in-process pipeline; changes are forwarded to the running worker."""
+        kind, changed = classify_settings(self.settings, settings, self.jpeg_quality)
+        self.settings = settings
+        if kind is None:
+            return
+        with self.worker_lock:
+            running = self.worker is not None
+            if running and kind != 'page':
+                self.control.put((settings, time.time()))
+        if kind == 'device' and running:
+            self.reconfiguring = {'changed': changed, 'started': time.time(), 'method': None}
+            return
+        method = "deferred" if kind == 'device' else "hot"
+        self.last_reconfigure = reconfigure_report(self.stream_id, kind, changed, method, 0)
+
+    def _spawn(self):
+        """Start the worker process. Caller holds worker_lock."""
+        print(f"[{self.stream_id}] Starting capture worker (camera index: {self.camera_index})...")
+        self.ring.set_status(STATE_STARTING)
+        context = multiprocessing.get_context("spawn")
+        # Fresh queues per worker: a terminated worker can leave a queue unusable
+        self.control = context.Queue()
+        self.reports = context.Queue()
+        self.reconfiguring = None
+        self.adaptive_state = None
+        self.worker = context.Process(
+            target=run_capture_worker, daemon=True, name=f"capture-{self.stream_id}",
+            args=(self.stream_id, self.ring.name, self.camera_index, self.settings, self.target_fps, self.jpeg_quality,
+                  self.control, self.reports, self.modes))
+        self.worker.start()
+
+    def probe_modes(self):
+        if self.camera_index == SYNTHETIC_CAMERA:
+            return None
+        with self.worker_lock:
+            if self.worker is not None:
+                return None
+            modes = update_capabilities(self.camera_index)
+            if modes:
+                self.modes = modes
+        return modes
+
+    def _stop_worker(self):
+        """Caller holds worker_lock."""
+        if self.worker is not None:
+            self.worker.terminate()
+            self.worker.join(5)
+            self.worker = None
+        self.frame_cache = (self.frame_cache[0], None, None)
+        self.adaptive_state = None
+
+    def tick(self):
+        with self.viewer_lock:
+            current_viewers = self.active_viewers
+
+        with self.worker_lock:
+            while self.reports is not None:
+                try:
+                    kind, report = self.reports.get_nowait()
+                except queue.Empty:
+                    break
+                if kind == 'adaptive':
+                    self.adaptive_state = report
+                else:
+                    self.last_reconfigure = report
+                    self.reconfiguring = None
+
+            if self.worker is not None and not self.worker.is_alive():
+                exitcode = self.worker.exitcode
+                self.worker = None
+                if exitcode == 2:
+                    print(f"[{self.stream_id}] Capture worker could not open camera {self.camera_index}.")
+                    self.restart_at = time.time() + self.OPEN_RETRY_DELAY
+                else:
+                    print(f"[{self.stream_id}] Capture worker died (exit code {exitcode}).")
+                    self.restart_at = time.time() + self.RESTART_DELAY
+
+            # Viewers are still connected, bring the worker back
+            if self.worker is None and current_viewers and time.time() >= self.restart_at:
+                self._spawn()
+
+        if current_viewers == 0 and self.last_access_time and (time.time() - self.last_access_time) > self.idle_timeout:
+            with self.worker_lock:
+                if self.worker is not None:
+                    print(f"[{self.stream_id}] Stopping capture worker due to inactivity.")
+                    self._stop_worker()
+            self.last_access_time = None
+
+    def broadcast_resolution(self):
+        if not self.is_running():
+            return "0x0@0"
+        header = self.ring.header()
+        return f"{header['width']}x{header['height']}@{header['fps']}"
+
+    def close(self):
+        with self.worker_lock:
+            self._stop_worker()
+        self.ring.close()
@@ -0,0 +1,107 @@
+import struct
+import time
+from multiprocessing import shared_memory
+
+# Header: magic, slot count, slot size, latest sequence number, worker state, width, height, fps
+HEADER = struct.Struct("<4sIIQIIId")
+# Per slot: sequence number of the frame in it, JPEG length, capture timestamp
+SLOT_HEADER = struct.Struct("<QId")
+MAGIC = b"KVMR"
+
+STATE_STARTING = 0
+STATE_RUNNING = 1
+STATE_FAILED = 2
+
+
+class FrameRing:
+    """
+    Fixed ring of encoded frames in shared memory, written by one capture process
+    and read by any number of viewers in other processes.
+
+    The writer fills slot seq % slots, stamps it with seq and then publishes seq as
+    latest. A reader copies the newest slot and checks the stamp is unchanged
+    afterwards, so it never returns a frame that was overwritten mid-read.
+    """
+
+    def __init__(self, name=None, slots=4, slot_size=2 * 1024 * 1024, create=False):
+        if create:
+            size = HEADER.size + slots * (SLOT_HEADER.size + slot_size)
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            HEADER.pack_into(self.shm.buf, 0, MAGIC, slots, slot_size, 0, STATE_STARTING, 0, 0, 0.0)
+        else:
+            self.shm = _attach(name)
+            magic, slots, slot_size = HEADER.unpack_from(self.shm.buf, 0)[:3]
+            if magic != MAGIC:
+                raise ValueError(f"Shared memory {name!r} is not a frame ring")
+        self.name = self.shm.name
+        self.slots = slots
+        self.slot_size = slot_size
+        self.owner = create
+
+    def _slot_offset(self, seq):
+        return HEADER.size + (seq % self.slots) * (SLOT_HEADER.size + self.slot_size)
+
+    @property
+    def latest_seq(self):
+        return struct.unpack_from("<Q", self.shm.buf, 12)[0]
+
+    def header(self):
+        _, _, _, seq, state, width, height, fps = HEADER.unpack_from(self.shm.buf, 0)
+        return {'seq': seq, 'state': state, 'width': width, 'height': height, 'fps': fps}
+
+    def set_status(self, state, width=0, height=0, fps=0.0):
+        HEADER.pack_into(self.shm.buf, 0, MAGIC, self.slots, self.slot_size, self.latest_seq,
+                         state, width, height, fps)
+
+    def write(self, data, timestamp=None):
+        """Publish one encoded frame (bytes-like). Returns False if it doesn't fit a slot."""
+        length = len(data)
+        if length > self.slot_size:
+            return False
+        seq = self.latest_seq + 1
+        offset = self._slot_offset(seq)
+        # Invalidate the slot first so a reader that lapped us sees the change
+        SLOT_HEADER.pack_into(self.shm.buf, offset, 0, 0, 0.0)
+        start = offset + SLOT_HEADER.size
+        self.shm.buf[start:start + length] = data
+        SLOT_HEADER.pack_into(self.shm.buf, offset, seq, length, timestamp or time.time())
+        struct.pack_into("<Q", self.shm.buf, 12, seq)
+        return True
+
+    def read(self, after_seq=0):
+        """
+        Copy out the newest frame if it is newer than after_seq.
+        Returns (seq, timestamp, bytes) or (latest_seq, None, None) when there is nothing new.
+        """
+        for _ in range(3):
+            seq = self.latest_seq
+            if seq == 0 or seq <= after_seq:
+                return seq, None, None
+            offset = self._slot_offset(seq)
+            slot_seq, length, timestamp = SLOT_HEADER.unpack_from(self.shm.buf, offset)
+            if slot_seq != seq:
+                continue
+            start = offset + SLOT_HEADER.size
+            data = bytes(self.shm.buf[start:start + length])
+            if SLOT_HEADER.unpack_from(self.shm.buf, offset)[0] == seq:
+                return seq, timestamp, data
+        # Writer lapped us repeatedly, nothing consistent to return this time
+        return after_seq, None, None
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def _attach(name):
+    """Attach to an existing ring without taking ownership of the segment."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 has no track flag. Worker processes share the creator's resource
+        # tracker, which forgets the segment when the creator unlinks it.
+        return shared_memory.SharedMemory(name=name)
@@ -1,6 +1,9 @@
 import cv2
+import json
 import os
 import platform
+import threading
+import time
 from datetime import datetime
 
 def get_camera_names():
@@ -70,43 +73,385 @@ def get_camera_names():
     
     return camera_names
 
-def list_cameras(max_cameras=10):
+INVENTORY_FILE = "camera_inventory.json"
+PROBE_TIMEOUT = 5  # Seconds before giving up on a single device probe
+INVENTORY_TTL = 24 * 3600  # Re-probe after this long where devices can't be fingerprinted (Windows/macOS)
+REPROBE_DELAY = 30  # Seconds before trying again a device that was busy or whose probe failed
+
+
+def _read_sysfs(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _usb_identity(sysfs_device):
+    """Walk up from a video4linux device to the USB device holding idVendor/idProduct."""
+    path = os.path.realpath(sysfs_device)
+    while path and path != '/':
+        vendor = _read_sysfs(os.path.join(path, 'idVendor'))
+        product = _read_sysfs(os.path.join(path, 'idProduct'))
+        if vendor and product:
+            serial = _read_sysfs(os.path.join(path, 'serial')) or os.path.basename(path)
+            return f"usb:{vendor}:{product}:{serial}"
+        path = os.path.dirname(path)
+    return None
+
+
+def enumerate_devices():
+    """
+    Cheap device listing without opening anything.
+    On Linux this reads /sys/class/video4linux and skips metadata nodes, elsewhere it
+    returns None since indices can only be found by probing.
+    """
+    if platform.system() != "Linux":
+        return None
+    import glob
+    devices = []
+    for sysfs_path in sorted(glob.glob('/sys/class/video4linux/video*')):
+        node = os.path.basename(sysfs_path)
+        try:
+            index = int(node[len('video'):])
+        except ValueError:
+            continue
+        # UVC devices expose a second node per camera for metadata, only index 0 captures
+        if (_read_sysfs(os.path.join(sysfs_path, 'index')) or '0') != '0':
+            continue
+        name = _read_sysfs(os.path.join(sysfs_path, 'name')) or f"Camera {index}"
+        identity = _usb_identity(os.path.join(sysfs_path, 'device')) or f"{name}@{node}"
+        devices.append({'index': index, 'node': f"/dev/{node}", 'name': name, 'identity': identity})
+    return devices
+
+
+def device_in_use(node):
+    """True if another process has the device node open (Linux only)."""
+    import glob
+    for fd in glob.glob('/proc/[0-9]*/fd/*'):
+        try:
+            # Our own fds don't count, keep looking for anyone else's
+            if os.readlink(fd) == node and int(fd.split('/')[2]) != os.getpid():
+                return True
+        except OSError:
+            continue
+    return False
+
+
+def probe_device(index):
+    """Open one device, read its current mode and confirm it delivers a frame."""
+    cap = cv2.VideoCapture(index)
+    try:
+        if not cap.isOpened():
+            return None
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        ret, _ = cap.read()
+        if not ret:
+            return None
+        try:
+            backend = cap.getBackendName()
+        except Exception:
+            backend = None
+        return {'backend': backend, 'modes': [{'width': width, 'height': height, 'fps': round(fps, 2)}]}
+    finally:
+        cap.release()
+
+
+def probe_devices(indices, timeout=PROBE_TIMEOUT):
+    """Probe devices in parallel, each bounded by `timeout`. Returns {index: result or None}."""
+    results = {}
+
+    def worker(i):
+        try:
+            results[i] = probe_device(i)
+        except Exception as e:
+            print(f"Probe of camera {i} failed: {e}")
+            results[i] = None
+
+    # Daemon threads so a hung driver can't keep the process alive
+    threads = {i: threading.Thread(target=worker, args=(i,), daemon=True) for i in indices}
+    for t in threads.values():
+        t.start()
+    deadline = time.time() + timeout
+    for i, t in threads.items():
+        t.join(max(0, deadline - time.time()))
+        if t.is_alive():
+            print(f"Probe of camera {i} timed out after {timeout}s")
+    return {i: results.get(i) for i in indices}
+
+
+# Tried when v4l2-ctl isn't available to list what the device supports
+CANDIDATE_FORMATS = ('MJPG', 'YUYV')
+CANDIDATE_RESOLUTIONS = ((1920, 1080), (1280, 720), (1024, 768), (800, 600), (720, 576), (720, 480), (640, 480))
+CANDIDATE_FPS = (60, 30, 25, 24)
+MEASURE_FRAMES = 30  # Frames timed per mode when measuring delivered fps and decode cost
+
+
+def fourcc_to_str(value):
+    value = int(value)
+    return ''.join(chr((value >> (8 * i)) & 0xFF) for i in range(4)).strip('\x00 ')
+
+
+def list_device_formats(node):
+    """
+    Supported (format, width, height, [fps, ...]) of a V4L2 device from
+    `v4l2-ctl --list-formats-ext`. Returns None if v4l2-ctl isn't installed or fails.
+    """
+    import re
+    import subprocess
+    try:
+        result = subprocess.run(["v4l2-ctl", "-d", node, "--list-formats-ext"],
+                                capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if result.returncode != 0:
+        return None
+    formats = []
+    pixel_format = None
+    for line in result.stdout.splitlines():
+        match = re.search(r"\[\d+\]: '(\w+)'", line)
+        if match:
+            pixel_format = match.group(1)
+            continue
+        match = re.search(r"Size: Discrete (\d+)x(\d+)", line)
+        if match and pixel_format:
+            formats.append((pixel_format, int(match.group(1)), int(match.group(2)), []))
+            continue
+        match = re.search(r"\(([\d.]+) fps\)", line)
+        if match and formats:
+            formats[-1][3].append(float(match.group(1)))
+    return formats
+
+
+def _set_mode(cap, pixel_format, width, height, fps):
+    """Ask for a mode and return what the driver actually negotiated."""
+    cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*pixel_format))
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    cap.set(cv2.CAP_PROP_FPS, fps)
+    return (fourcc_to_str(cap.get(cv2.CAP_PROP_FOURCC)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), cap.get(cv2.CAP_PROP_FPS))
+
+
+def trial_formats(cap):
+    """Fallback for list_device_formats: set each candidate mode and keep the ones the driver accepts."""
+    formats = {}
+    for pixel_format in CANDIDATE_FORMATS:
+        for width, height in CANDIDATE_RESOLUTIONS:
+            for fps in CANDIDATE_FPS:
+                got = _set_mode(cap, pixel_format, width, height, fps)
+                if got[:3] != (pixel_format, width, height):
+                    break  # Size or format refused, other rates won't help
+                rates = formats.setdefault((pixel_format, width, height), [])
+                if round(got[3]) not in [round(r) for r in rates]:
+                    rates.append(got[3])
+    return [(f, w, h, rates) for (f, w, h), rates in formats.items()]
+
+
+def measure_mode(cap, pixel_format, width, height, fps, frames=MEASURE_FRAMES):
+    """
+    Switch to a mode and time it: delivered fps from wall time per frame, decode cost
+    from CPU time per frame (waiting for the device doesn't use CPU, decoding MJPG or
+    converting YUYV does). Returns None if the device doesn't deliver frames of that size.
+    """
+    _set_mode(cap, pixel_format, width, height, fps)
+    for _ in range(5):  # Let the device settle on the new mode
+        ret, frame = cap.read()
+        if not ret or frame.shape[1] != width or frame.shape[0] != height:
+            return None
+    start, cpu_start = time.perf_counter(), time.thread_time()
+    for _ in range(frames):
+        if not cap.read()[0]:
+            return None
+    elapsed, cpu = time.perf_counter() - start, time.thread_time() - cpu_start
+    return {'format': pixel_format, 'width': width, 'height': height, 'fps': round(fps, 2),
+            'measured_fps': round(frames / elapsed, 2), 'decode_ms': round(cpu / frames * 1000, 2)}
+
+
+def probe_capabilities(index, node=None, frames=MEASURE_FRAMES):
+    """
+    Enumerate every pixel format, resolution and frame rate a device supports and
+    measure each resolution at its highest rate. Takes about a second per mode, so this
+    runs on demand (settings page, --probe-modes) rather than during discovery.
+    """
+    formats = list_device_formats(node) if node else None
+    cap = cv2.VideoCapture(index)
+    try:
+        if not cap.isOpened():
+            return None
+        if not formats:
+            formats = trial_formats(cap)
+        modes = []
+        for pixel_format, width, height, rates in formats:
+            rates = sorted(rates or [30], reverse=True)
+            print(f"Measuring camera {index}: {pixel_format} {width}x{height}@{rates[0]:g}")
+            mode = measure_mode(cap, pixel_format, width, height, rates[0], frames)
+            if mode is None:
+                print(f"  {pixel_format} {width}x{height} listed but not delivered, skipped")
+                continue
+            mode['fps_options'] = rates
+            modes.append(mode)
+        return modes
+    finally:
+        cap.release()
+
+
+def update_capabilities(index, path=INVENTORY_FILE):
+    """Probe a device's modes and cache them on its inventory entry. Returns the modes or None."""
+    devices = get_inventory(path=path)
+    entry = next((d for d in devices.values() if d['index'] == index), None)
+    node = entry['node'] if entry else None
+    if node and device_in_use(node):
+        print(f"Not probing {node}, in use by another process")
+        return None
+    modes = probe_capabilities(index, node)
+    if modes is None or entry is None:
+        return modes
+    # Re-read in case discovery rewrote the file while we were measuring
+    inventory = load_inventory(path)
+    entry = inventory['devices'].get(entry['identity'])
+    if entry is not None:
+        entry['capabilities'] = modes
+        entry['capabilities_probed'] = time.time()
+        save_inventory(inventory, path)
+    return modes
+
+
+def device_capabilities(index):
+    """Cached capability list for a device index (see probe_capabilities), or [] if it was never probed."""
+    for device in get_inventory(probe=False).values():
+        if device['index'] == index:
+            return device.get('capabilities') or []
+    return []
+
+
+def _fingerprint(devices):
+    if devices is None:
+        return None
+    return sorted(f"{d['node']}={d['identity']}" for d in devices)
+
+
+def load_inventory(path=INVENTORY_FILE):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'fingerprint': None, 'updated': 0, 'devices': {}}
+
+
+def save_inventory(inventory, path=INVENTORY_FILE):
+    with open(path, 'w') as f:
+        json.dump(inventory, f, indent=4)
+
+
+def _needs_probe(entry, now):
+    """No modes yet (new, busy, failed or timed out) and not tried in the last REPROBE_DELAY seconds."""
+    return not entry.get('modes') and now - entry.get('probe_attempted', 0) >= REPROBE_DELAY
+
+
+def get_inventory(probe=True, refresh=False, max_cameras=10, path=INVENTORY_FILE):
+    """
+    Return the cached device inventory, {identity: {index, node, name, modes, ...}}.
+
+    The cache is reused as long as the set of devices hasn't changed. With probe=False
+    nothing is ever opened: new devices are listed from sysfs with no modes yet.
+    Only devices without modes are probed, and never ones another process has open;
+    busy or failed devices are retried after REPROBE_DELAY, complete entries are kept.
+    """
+    inventory = load_inventory(path)
+    cached = inventory['devices']
+    devices = enumerate_devices()
+    fingerprint = _fingerprint(devices)
+    now = time.time()
+
+    if devices is not None:
+        fresh = fingerprint == inventory['fingerprint'] and not (
+            probe and any(_needs_probe(entry, now) for entry in cached.values()))
+    else:
+        fresh = bool(cached) and time.time() - inventory['updated'] < INVENTORY_TTL
+    if fresh and not refresh:
+        return cached
+
+    if devices is None:
+        # No cheap listing on this platform, the only way is to probe every index
+        if not probe:
+            return cached
+        names = get_camera_names()
+        devices = [{'index': i, 'node': None, 'name': names.get(i, f"Camera {i}"), 'identity': None}
+                   for i in range(max_cameras)]
+
+    present = {}
+    to_probe = []
+    for device in devices:
+        entry = dict(cached.get(device['identity']) or {}) if device['identity'] else {}
+        entry.update(device)
+        if probe and (refresh or _needs_probe(entry, now)):
+            if device['node'] and device_in_use(device['node']):
+                print(f"Skipping {device['node']} ({device['name']}), in use by another process")
+                entry['probe_attempted'] = now
+            else:
+                to_probe.append(device['index'])
+        present[device['index']] = entry
+
+    results = probe_devices(to_probe) if to_probe else {}
+    devices_by_identity = {}
+    for index, entry in present.items():
+        if index in results:
+            entry['probe_attempted'] = now
+            if results[index] is None:
+                if entry['identity'] is None:
+                    continue  # Probed blind and nothing there
+                entry['modes'] = []
+            else:
+                entry.update(results[index])
+                entry['probed'] = time.time()
+        if entry['identity'] is None:
+            entry['identity'] = f"{entry['name']}@{index}"
+        devices_by_identity[entry['identity']] = entry
+
+    inventory = {'fingerprint': fingerprint, 'updated': time.time(), 'devices': devices_by_identity}
+    if probe:
+        save_inventory(inventory, path)
+    return devices_by_identity
+
+
+def select_camera_index(preferred=None, default=0):
+    """
+    Pick a capture index from the inventory without opening any device.
+    `preferred` may be an index, a device identity or part of a device name.
+    Without one, devices that probed with modes or sit on USB come first, so a
+    Raspberry Pi's codec and ISP nodes aren't picked over the capture card.
+    """
+    devices = sorted(get_inventory(probe=False).values(),
+                     key=lambda d: (not (d.get('modes') or str(d['identity']).startswith('usb:')), d['index']))
+    if isinstance(preferred, int):
+        return preferred
+    if preferred:
+        for device in devices:
+            if preferred == device['identity'] or preferred.lower() in device['name'].lower():
+                return device['index']
+        print(f"Camera {preferred!r} not found, falling back to default")
+    if devices:
+        return devices[0]['index']
+    return default
+
+
+def list_cameras(max_cameras=10, refresh=False):
     """
     List all available cameras/capture devices
     Returns a list of tuples (index, name/info)
     """
-    available_cameras = []
-    
     print("Scanning for available cameras...")
-    
-    # Get system-specific camera names
-    camera_names = get_camera_names()
-    
-    for i in range(max_cameras):
-        cap = cv2.VideoCapture(i)
-        if cap.isOpened():
-            # Try to get some info about the camera
-            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            
-            # Get camera name from system info or fallback
-            if i in camera_names:
-                camera_name = camera_names[i]
-            else:
-                try:
-                    backend_name = cap.getBackendName()
-                    camera_name = f"Device {i} ({backend_name})"
-                except:
-                    camera_name = f"Camera {i}"
-            
-            # Try to read a frame to confirm it's working
-            ret, frame = cap.read()
-            if ret:
-                available_cameras.append((i, f"{camera_name} - Resolution: {width}x{height}, FPS: {fps:.1f}"))
-            
-            cap.release()
-    
+    available_cameras = []
+    for device in sorted(get_inventory(refresh=refresh, max_cameras=max_cameras).values(),
+                         key=lambda d: d['index']):
+        if not device.get('modes'):
+            continue
+        mode = device['modes'][0]
+        available_cameras.append((device['index'], f"{device['name']} - Resolution: "
+                                  f"{mode['width']}x{mode['height']}, FPS: {mode['fps']:.1f}"))
     return available_cameras
 
 def capture_frame(camera_index, output_filename=None):
@@ -206,5 +551,21 @@ def main():
     else:
         print("Capture failed!")
 
+def print_capabilities(index):
+    modes = update_capabilities(index)
+    if not modes:
+        print(f"No modes found for camera {index}")
+        return
+    print(f"\nCamera {index} modes:")
+    for mode in modes:
+        rates = ', '.join(f"{r:g}" for r in mode['fps_options'])
+        print(f"  {mode['format']} {mode['width']}x{mode['height']} ({rates} fps) - "
+              f"delivered {mode['measured_fps']} fps, {mode['decode_ms']} ms decode per frame")
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "--probe-modes":
+        # python get_video_output.py --probe-modes [INDEX]
+        print_capabilities(int(sys.argv[2]) if len(sys.argv) > 2 else 0)
+    else:
+        main()
\ No newline at end of file
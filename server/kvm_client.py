@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+Persistent client library for the Pi HID servers (TCP and WebSocket).
+
+Keeps connections open instead of connecting per command, pipelines requests
+and matches each response back to the command that caused it.
+
+Usage:
+  async with KVMClient("tcp://raspberrypi.local:5555") as client:
+      print(await client.request("KEY enter"))
+
+  async with KVMClient("ws://raspberrypi.local:5000") as client:
+      replies = await asyncio.gather(*(client.request({"type": "MOUSE", "action": "MOVE", "key": "5|0"})
+                                      for _ in range(100)))
+
+Correlation:
+  - dict commands are sent as JSON with an "id" field; servers that echo the id
+    (zerohidserver does) get their reply matched by id, in any order.
+  - string commands are matched in order: the Nth id-less reply on a connection
+    answers the Nth id-less command sent on it.
+  - JSON messages of type SESSION without an id (zerohidserver role broadcasts) are
+    never replies, they go to on_event, as does anything arriving with nothing pending.
+    Send SESSION requests as dicts so their reply comes back with an id.
+  - "ERROR..." replies are raised as KVMError.
+
+Pooling: input has to reach the target in the order it was typed, so requests use
+the first connection unless sent with ordered=False. zerohidserver treats every
+connection as its own session and only one session controls the keyboard, so extra
+pooled connections only help with `zerohidserver.py --shared`.
+"""
+
+import asyncio
+import itertools
+import json
+import struct
+from collections import deque
+from urllib.parse import urlparse
+
+
+class KVMError(Exception):
+    """The server answered a command with an ERROR reply."""
+
+
+class NotSentError(ConnectionError):
+    """The command never reached the server, so it is safe to send again."""
+
+
+def is_event(message):
+    """True for messages the server sends on its own, like zerohidserver's SESSION broadcasts."""
+    try:
+        payload = json.loads(message)
+    except ValueError:
+        return False
+    return isinstance(payload, dict) and payload.get("type") == "SESSION" and "id" not in payload
+
+
+class TCPTransport:
+    """Newline (default) or 4-byte length-prefixed framing over one TCP socket."""
+
+    def __init__(self, host, port, framing="newline", timeout=5.0, greeting_timeout=0.5):
+        self.host = host
+        self.port = port
+        self.framing = framing
+        self.timeout = timeout
+        self.greeting_timeout = greeting_timeout
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), timeout=self.timeout)
+        # The server may greet us once per connection; don't mistake it for a reply
+        try:
+            greeting = await asyncio.wait_for(self.recv(), timeout=self.greeting_timeout)
+            if greeting:
+                print(greeting.rstrip("\n"))
+        except asyncio.TimeoutError:
+            pass
+
+    async def send(self, message):
+        data = message.encode()
+        if self.framing == "length":
+            self.writer.write(struct.pack("!I", len(data)) + data)
+        else:
+            self.writer.write(data.rstrip(b"\n") + b"\n")
+        await self.writer.drain()
+
+    async def recv(self):
+        if self.framing == "length":
+            header = await self.reader.readexactly(4)
+            (length,) = struct.unpack("!I", header)
+            data = await self.reader.readexactly(length)
+        else:
+            data = await self.reader.readline()
+            if not data:
+                raise ConnectionError("Connection closed by server")
+        return data.decode(errors="ignore").rstrip("\r\n")
+
+    async def close(self):
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except Exception:
+                pass
+            self.writer = None
+
+
+class WebSocketTransport:
+    """One message per command over a persistent WebSocket."""
+
+    def __init__(self, url, timeout=5.0, greeting_timeout=0.5):
+        self.url = url
+        self.timeout = timeout
+        self.greeting_timeout = greeting_timeout
+        self.ws = None
+        self.early = deque()  # Events that arrived while waiting for a greeting
+
+    async def connect(self):
+        import websockets
+        self.ws = await websockets.connect(self.url, open_timeout=self.timeout, close_timeout=self.timeout)
+        # Same optional greeting as the TCP server; zerohidserver sends its SESSION role instead, keep that
+        try:
+            greeting = await asyncio.wait_for(self.recv(), timeout=self.greeting_timeout)
+        except asyncio.TimeoutError:
+            return
+        if is_event(greeting):
+            self.early.append(greeting)
+        elif greeting:
+            print(greeting.rstrip("\n"))
+
+    async def send(self, message):
+        await self.ws.send(message)
+
+    async def recv(self):
+        if self.early:
+            return self.early.popleft()
+        try:
+            message = await self.ws.recv()
+        except Exception as e:
+            raise ConnectionError(f"WebSocket closed: {e}") from e
+        if isinstance(message, (bytes, bytearray)):
+            message = message.decode(errors="ignore")
+        return message
+
+    async def close(self):
+        if self.ws:
+            await self.ws.close()
+            self.ws = None
+
+
+def transport_for(url, **kwargs):
+    """Build a transport from tcp://host:port, ws://... or wss://... URLs."""
+    parsed = urlparse(url)
+    if parsed.scheme in ("ws", "wss"):
+        return WebSocketTransport(url, **kwargs)
+    if parsed.scheme == "tcp":
+        return TCPTransport(parsed.hostname, parsed.port or 5555, **kwargs)
+    raise ValueError(f"Unsupported URL scheme: {url!r}")
+
+
+class KVMConnection:
+    """A single persistent connection with pipelined, correlated requests."""
+
+    def __init__(self, url, on_event=None, **transport_kwargs):
+        self.url = url
+        self.on_event = on_event
+        self.transport_kwargs = transport_kwargs
+        self.transport = None
+        self.reader_task = None
+        self.connect_lock = asyncio.Lock()
+        self.ids = itertools.count(1)
+        self.by_id = {}
+        self.in_order = deque()
+
+    @property
+    def connected(self):
+        return self.reader_task is not None and not self.reader_task.done()
+
+    @property
+    def pending(self):
+        return len(self.by_id) + len(self.in_order)
+
+    async def connect(self):
+        async with self.connect_lock:
+            if self.connected:
+                return
+            self.transport = transport_for(self.url, **self.transport_kwargs)
+            await self.transport.connect()
+            self.reader_task = asyncio.ensure_future(self._read_loop())
+
+    async def _read_loop(self):
+        try:
+            while True:
+                message = await self.transport.recv()
+                self._dispatch(message)
+        except (ConnectionError, asyncio.IncompleteReadError, OSError) as e:
+            self._fail_pending(ConnectionError(f"Connection to {self.url} lost: {e}"))
+        except asyncio.CancelledError:
+            self._fail_pending(ConnectionError("Connection closed"))
+            raise
+
+    def _dispatch(self, message):
+        try:
+            payload = json.loads(message)
+        except ValueError:
+            payload = None
+        if isinstance(payload, dict) and payload.get("id") in self.by_id:
+            future = self.by_id.pop(payload["id"])
+            if not future.done():
+                future.set_result(payload.get("result", payload))
+            return
+        if self.in_order and not is_event(message):
+            future = self.in_order.popleft()
+            if not future.done():
+                future.set_result(message)
+            return
+        if self.on_event:
+            self.on_event(message)
+
+    def _fail_pending(self, error):
+        for future in list(self.by_id.values()) + list(self.in_order):
+            if not future.done():
+                future.set_exception(error)
+        self.by_id.clear()
+        self.in_order.clear()
+
+    async def request(self, command, timeout=5.0):
+        """
+        Send one command and wait for its reply. Many requests may be in flight at once.
+        Raises NotSentError if it couldn't be sent, ConnectionError if the connection
+        dropped after sending (it may or may not have been executed) and KVMError for
+        ERROR replies.
+        """
+        if not self.connected:
+            try:
+                await self.connect()
+            except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+                raise NotSentError(f"Could not connect to {self.url}: {e}") from e
+        future = asyncio.get_running_loop().create_future()
+        if isinstance(command, dict):
+            request_id = next(self.ids)
+            self.by_id[request_id] = future
+            message = json.dumps(dict(command, id=request_id))
+        else:
+            request_id = None
+            self.in_order.append(future)
+            message = command.strip()
+        try:
+            await self.transport.send(message)
+        except Exception as e:
+            if request_id is not None:
+                self.by_id.pop(request_id, None)
+            elif future in self.in_order:
+                self.in_order.remove(future)
+            await self.close()
+            raise NotSentError(f"Send to {self.url} failed: {e}") from e
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        except asyncio.TimeoutError:
+            # In-order futures stay queued so a late reply is still consumed in order
+            if request_id is not None:
+                self.by_id.pop(request_id, None)
+            raise
+        if isinstance(result, str) and result.startswith("ERROR"):
+            raise KVMError(result)
+        return result
+
+    async def close(self):
+        if self.reader_task:
+            self.reader_task.cancel()
+            try:
+                await self.reader_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self.reader_task = None
+        if self.transport:
+            await self.transport.close()
+            self.transport = None
+
+
+class KVMClient:
+    """
+    Small pool of persistent connections to one server, same interface for TCP and WebSocket.
+    Ordered requests (the default) all go to the first connection, ordered=False ones to
+    the least busy. Requests that never got sent are retried on a fresh connection; ones
+    lost after sending are not, since replaying input would type it twice.
+    """
+
+    def __init__(self, url, pool_size=1, retries=2, retry_delay=0.2, on_event=None, **transport_kwargs):
+        self.url = url
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.connections = [KVMConnection(url, on_event=on_event, **transport_kwargs)
+                            for _ in range(pool_size)]
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def connect(self):
+        await asyncio.gather(*(c.connect() for c in self.connections))
+
+    async def request(self, command, timeout=5.0, ordered=True):
+        attempt = 0
+        while True:
+            if ordered:
+                connection = self.connections[0]
+            else:
+                connection = min(self.connections, key=lambda c: (not c.connected, c.pending))
+            try:
+                return await connection.request(command, timeout=timeout)
+            except NotSentError as e:
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                print(f"Reconnecting to {self.url} after error: {e}")
+                await connection.close()
+                await asyncio.sleep(self.retry_delay * attempt)
+
+    async def close(self):
+        await asyncio.gather(*(c.close() for c in self.connections))
+
+
+def interactive(url):
+    """
+    REPL over one persistent client; each line is sent as-is. input() stays on the main
+    thread so Ctrl+C quits straight away, the client runs on the loop between lines.
+    """
+    print(f"Connected target set to {url}")
+    print("Ctrl+C or Ctrl+D to quit.\n")
+    loop = asyncio.new_event_loop()
+    client = KVMClient(url, on_event=lambda m: print(f"[event] {m}"))
+    try:
+        loop.run_until_complete(client.connect())
+        while True:
+            try:
+                line = input("> ").strip()
+            except EOFError:
+                return
+            if not line:
+                continue
+            try:
+                resp = loop.run_until_complete(client.request(line))
+                if resp:
+                    print(resp)
+            except Exception as e:
+                print(f"Error: {e}")
+    finally:
+        loop.run_until_complete(client.close())
+        loop.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Persistent client for the Pi HID servers")
+    parser.add_argument("url", help="tcp://host:port or ws://host:port")
+    args = parser.parse_args()
+    try:
+        interactive(args.url)
+    except KeyboardInterrupt:
+        print("\nBye.")
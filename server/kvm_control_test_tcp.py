@@ -15,6 +15,9 @@ Command format (sent to the Pi server):
   MOVE <dx> <dy>
   SCROLL <n>
   CLICK <left|right|middle>
+
+--cmd opens a connection per command; --interactive keeps one open via kvm_client.py.
+For scripting many commands use kvm_client.KVMClient directly.
 """
 
 import argparse
@@ -63,7 +66,9 @@ def send_command(host: str, port: int, command: str, timeout: float = 5.0) -> st
 
 
 def interactive(host: str, port: int):
-    print(f"Connected target set to {host}:{port}")
+    """REPL over one persistent, reconnecting connection (see kvm_client.py)."""
+    import kvm_client
+
     print("Type commands like:")
     print('  TYPE hello world!')
     print('  KEY enter')
@@ -71,20 +76,10 @@ def interactive(host: str, port: int):
     print('  MOVE 30 10')
     print('  SCROLL -1')
     print('  CLICK left')
-    print("Ctrl+C to quit.\n")
-    while True:
-        try:
-            line = input("> ").strip()
-            if not line:
-                continue
-            resp = send_command(host, port, line)
-            if resp:
-                print(resp, end="" if resp.endswith("\n") else "\n")
-        except KeyboardInterrupt:
-            print("\nBye.")
-            return
-        except Exception as e:
-            print(f"Error: {e}")
+    try:
+        kvm_client.interactive(f"tcp://{host}:{port}")
+    except KeyboardInterrupt:
+        print("\nBye.")
 
 
 def main():
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+End-to-end input-to-photon latency harness.
+
+Injects an input event through zerohidserver, timestamps it, watches the frames
+served by server.py for the resulting pixel change in a region of interest and
+reports latency percentiles.
+
+Usage examples:
+  # Real hardware: toggle caps lock, watch the keyboard LED indicator area of the screen
+  python latency_probe.py --hid ws://raspberrypi.local:5000 --video http://raspberrypi.local:5001/video_feed \\
+      --event capslock --roi 1200,680,80,40 --trials 50
+
+  # Wiggle the mouse and watch the area around the cursor
+  python latency_probe.py --event mouse --roi 600,320,80,80
+
+  # No hardware (CI): fake HID server driving a synthetic capture source with 80ms pipeline delay
+  python latency_probe.py --loopback --loopback-delay 0.08 --trials 30
+
+Measured latency = time the first changed frame arrives here - time the event was sent,
+so it includes the HID path, the target machine, the capture card, encoding and the stream.
+"""
+
+import argparse
+import json
+import threading
+import time
+import urllib.request
+
+import cv2
+import numpy as np
+
+CAPS_LOCK = 0x39
+
+EVENTS = {
+    # Each event toggles something on screen; sending it twice puts it back
+    "capslock": [{"type": "KEYBOARD", "action": "PRESS", "modifiers": [], "key": CAPS_LOCK}],
+    "mouse": [{"type": "MOUSE", "action": "MOVE", "key": "40|0"},
+              {"type": "MOUSE", "action": "MOVE", "key": "-40|0"}],
+}
+
+
+class FrameSource:
+    """Latest grayscale frame (cropped to the ROI) plus the time it arrived."""
+
+    def __init__(self, roi=None):
+        self.roi = roi
+        self.cond = threading.Condition()
+        self.frame = None
+        self.frame_time = 0.0
+        self.count = 0
+        self.running = True
+
+    def _publish(self, frame, arrived):
+        with self.cond:
+            self.frame = crop(frame, self.roi)
+            self.frame_time = arrived
+            self.count += 1
+            self.cond.notify_all()
+
+    def wait_frame(self, after_count, timeout):
+        """Block until a frame newer than after_count arrives. Returns (count, time, frame)."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.count > after_count, timeout=timeout)
+            return self.count, self.frame_time, self.frame
+
+    def close(self):
+        self.running = False
+
+
+class MJPEGSource(FrameSource):
+    """Reads server.py's multipart MJPEG stream in a background thread."""
+
+    def __init__(self, url, roi=None):
+        super().__init__(roi)
+        self.url = url
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        stream = urllib.request.urlopen(self.url, timeout=10)
+        buffer = b""
+        while self.running:
+            # read1 returns whatever has arrived; read(n) would sit on the end of a frame
+            # until the next one pushed n bytes through, adding a frame interval to every result
+            chunk = stream.read1(65536)
+            if not chunk:
+                break
+            buffer += chunk
+            start = buffer.find(b"\xff\xd8")
+            end = buffer.find(b"\xff\xd9", start + 2)
+            while start != -1 and end != -1:
+                jpeg = buffer[start:end + 2]
+                buffer = buffer[end + 2:]
+                arrived = time.monotonic()
+                frame = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_GRAYSCALE)
+                if frame is not None:
+                    self._publish(frame, arrived)
+                start = buffer.find(b"\xff\xd8")
+                end = buffer.find(b"\xff\xd9", start + 2)
+
+
+class SyntheticDisplay(FrameSource):
+    """
+    Stand-in for target machine + capture card: renders a marker whenever the
+    toggle state (as of `delay` seconds ago) is set, at `fps` frames per second.
+    """
+
+    def __init__(self, fps=30, delay=0.08, size=(320, 240), roi=None):
+        super().__init__(roi)
+        self.fps = fps
+        self.delay = delay
+        self.size = size
+        self.history = [(0.0, False)]
+        self.state_lock = threading.Lock()
+        threading.Thread(target=self._render, daemon=True).start()
+
+    def toggle(self):
+        with self.state_lock:
+            self.history.append((time.monotonic(), not self.history[-1][1]))
+            self.history = self.history[-16:]
+
+    def _state_at(self, when):
+        with self.state_lock:
+            state = self.history[0][1]
+            for changed, value in self.history:
+                if changed <= when:
+                    state = value
+            return state
+
+    def _render(self):
+        width, height = self.size
+        interval = 1.0 / self.fps
+        while self.running:
+            now = time.monotonic()
+            frame = np.zeros((height, width), np.uint8)
+            if self._state_at(now - self.delay):
+                frame[height // 4:height * 3 // 4, width // 4:width * 3 // 4] = 255
+            self._publish(frame, now)
+            time.sleep(max(0.0, interval - (time.monotonic() - now)))
+
+
+def crop(frame, roi):
+    if not roi:
+        return frame
+    x, y, w, h = roi
+    return frame[y:y + h, x:x + w]
+
+
+def run_fake_hid(display, port):
+    """Loopback HID server speaking zerohidserver's protocol; every keyboard or mouse event toggles the display."""
+    from websockets.sync.server import serve
+
+    def handler(ws):
+        for message in ws:
+            payload = json.loads(message)
+            if payload.get("type") in ("KEYBOARD", "MOUSE"):
+                display.toggle()
+                reply = "OK"
+            else:
+                # SESSION requests (TAKEOVER...): this client is always in control
+                reply = {"type": "SESSION", "controller": 1, "you": 1, "shared": False}
+            if "id" in payload:
+                reply = {"id": payload["id"], "result": reply}
+            ws.send(reply if isinstance(reply, str) else json.dumps(reply))
+
+    server = serve(handler, "127.0.0.1", port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def drain_replies(ws):
+    """Discard server replies so they don't back up; we only time what reaches the screen."""
+    try:
+        while True:
+            ws.recv(timeout=0)
+    except TimeoutError:
+        pass
+
+
+def frame_changed(baseline, frame, threshold):
+    if frame is None or baseline is None or frame.shape != baseline.shape:
+        return False
+    return float(cv2.absdiff(frame, baseline).mean()) > threshold
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return float("nan")
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(hid_url, source, event, trials, threshold, timeout, settle):
+    """Run `trials` inject/observe cycles, returning a list of latencies in seconds."""
+    from websockets.sync.client import connect
+
+    payloads = EVENTS[event]
+    latencies = []
+    with connect(hid_url) as ws:
+        ws.send(json.dumps({"type": "SESSION", "action": "TAKEOVER"}))
+        for trial in range(trials):
+            time.sleep(settle)
+            drain_replies(ws)
+            count, _, baseline = source.wait_frame(source.count - 1, timeout)
+            payload = payloads[trial % len(payloads)]
+
+            sent = time.monotonic()
+            ws.send(json.dumps(payload))
+
+            latency = None
+            while time.monotonic() - sent < timeout:
+                count, arrived, frame = source.wait_frame(count, timeout)
+                if arrived >= sent and frame_changed(baseline, frame, threshold):
+                    latency = arrived - sent
+                    break
+            if latency is None:
+                print(f"Trial {trial + 1}: no change seen within {timeout}s")
+                continue
+            latencies.append(latency)
+            print(f"Trial {trial + 1}: {latency * 1000:.1f} ms")
+    return latencies
+
+
+def report(latencies, trials):
+    values = sorted(latencies)
+    print(f"\n{len(values)}/{trials} trials detected")
+    if not values:
+        return
+    print(f"  min  {values[0] * 1000:8.1f} ms")
+    for pct in (50, 90, 95, 99):
+        print(f"  p{pct:<3} {percentile(values, pct) * 1000:8.1f} ms")
+    print(f"  max  {values[-1] * 1000:8.1f} ms")
+    print(f"  mean {sum(values) / len(values) * 1000:8.1f} ms")
+
+
+def parse_roi(text):
+    if not text:
+        return None
+    x, y, w, h = (int(v) for v in text.split(","))
+    return (x, y, w, h)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure input-to-photon latency")
+    parser.add_argument("--hid", default="ws://raspberrypi.local:5000", help="zerohidserver WebSocket URL")
+    parser.add_argument("--video", default="http://raspberrypi.local:5001/video_feed", help="server.py MJPEG URL")
+    parser.add_argument("--event", choices=sorted(EVENTS), default="capslock", help="Input to inject")
+    parser.add_argument("--roi", help="Region to watch as x,y,w,h in frame pixels (default: whole frame)")
+    parser.add_argument("--threshold", type=float, default=4.0, help="Mean abs pixel difference that counts as a change")
+    parser.add_argument("--trials", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=2.0, help="Seconds to wait for a change per trial")
+    parser.add_argument("--settle", type=float, default=0.3, help="Seconds to wait before each trial")
+    parser.add_argument("--loopback", action="store_true", help="Use a fake HID server and synthetic capture source")
+    parser.add_argument("--loopback-delay", type=float, default=0.08, help="Synthetic pipeline delay in seconds")
+    parser.add_argument("--loopback-fps", type=float, default=30)
+    parser.add_argument("--loopback-port", type=int, default=5590)
+    args = parser.parse_args()
+
+    roi = parse_roi(args.roi)
+    if args.loopback:
+        source = SyntheticDisplay(fps=args.loopback_fps, delay=args.loopback_delay, roi=roi)
+        server = run_fake_hid(source, args.loopback_port)
+        hid_url = f"ws://127.0.0.1:{args.loopback_port}"
+    else:
+        source = MJPEGSource(args.video, roi=roi)
+        server = None
+        hid_url = args.hid
+
+    try:
+        latencies = measure(hid_url, source, args.event, args.trials, args.threshold, args.timeout, args.settle)
+    finally:
+        source.close()
+        if server:
+            server.shutdown()
+    report(latencies, args.trials)
+
+
+if __name__ == "__main__":
+    main()
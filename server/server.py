@@ -1,203 +1,114 @@
-import cv2
 import threading
 import time
-from flask import Flask, Response, render_template, request, jsonify, redirect
+from flask import Flask, Response, render_template, request, jsonify, redirect, abort
 import json
 import logging
-from queue import Queue
 import numpy as np
 import os
 import importlib
+import atexit
+from urllib.parse import quote
+import get_video_output
+import video_socket
+from capture_pipeline import (CapturePipeline, ProcessCapturePipeline, SYNTHETIC_CAMERA, AUTO_MODE, parse_roi,
+                              choose_mode, format_mode, demand_fps, adaptive_setting, ADAPTIVE_DEFAULTS)
 
 # Env variable OPENCV_VIDEOIO_MSMF_ENABLE_HW_TRANSFORMS = 0 on some devices for faster camera startup
 
 # --- Configuration ---
-CAMERA_INDEX = 0  # Change this to your capture card's index (e.g., 0, 1, 2)
+CAMERA_INDEX = 0  # Fallback index; set "camera" in config.json to an index, device name or identity instead
 CAMERA_NAME = "Capture Card Stream"  # A descriptive name for your stream
-JPEG_QUALITY = 85  # Image quality (0-100), higher is better quality but more data
+JPEG_QUALITY = 85  # Image quality (0-100), higher is better quality but more data. The ceiling when adaptive
 IDLE_TIMEOUT = 5  # Seconds to wait before stopping the camera when no one is watching
 BUFFER_SIZE = 2  # Keep only the latest N frames to reduce latency
-TARGET_FPS = 24  # Target frame rate
+TARGET_FPS = 24  # Target frame rate with adaptive capture off (see capture_pipeline.ADAPTIVE_DEFAULTS)
+DEFAULT_STREAM = "default"  # Stream id used when config.json has no "streams" section
+VIDEO_SOCKET_PORT = 5002  # WebSocket video with acknowledged frames, used when "video_transport" is "websocket"
 
 # --- Flask App Initialization ---
 app = Flask(__name__, template_folder='.')
 
 # --- Global Variables ---
-camera = None
-camera_lock = threading.Lock()
-frame_queue = Queue(maxsize=BUFFER_SIZE)
-latest_frame = None
-last_access_time = None
-capture_thread = None
-active_viewers = 0
-viewer_lock = threading.Lock()
-REINIT_CAMERA = False
+pipelines = {}  # stream id -> CapturePipeline, one per capture device
+pipelines_lock = threading.Lock()
+video_socket_server = None
+video_socket_lock = threading.Lock()
 loaded_plugins = []
 
 
-def camera_manager():
-    """
-    A thread that manages the camera resource.
-    It starts the camera when the first viewer connects and stops it when the last one leaves.
-    """
-    global camera, latest_frame, last_access_time, capture_thread, REINIT_CAMERA
+def stream_settings(config, stream_id):
+    """Top-level settings with this stream's overrides from config['streams'] applied."""
+    settings = {k: v for k, v in config.items() if k != 'streams'}
+    settings.update(config.get('streams', {}).get(stream_id, {}))
+    return settings
 
-    while True:
-        if REINIT_CAMERA:
-            with camera_lock:
-                if camera:
-                    print("Re-initializing camera with new settings.")
-                    camera.release()
-                    camera = None
-                    REINIT_CAMERA = False
-
-        with viewer_lock:
-            current_viewers = active_viewers
-
-        if current_viewers == 0 and last_access_time and (time.time() - last_access_time) > IDLE_TIMEOUT:
-            with camera_lock:
-                if camera:
-                    print("Stopping camera due to inactivity.")
-                    camera.release()
-                    camera = None
-                    # Clear the frame queue
-                    while not frame_queue.empty():
-                        try:
-                            frame_queue.get_nowait()
-                        except:
-                            break
-            last_access_time = None
 
-        time.sleep(1)
+def stream_ids(config):
+    return list(config.get('streams') or {DEFAULT_STREAM: {}})
+
+
+def start_video_socket_if_used(config):
+    """The WebSocket video port is only opened once a stream has "video_transport": "websocket"."""
+    global video_socket_server
+    if not any(stream_settings(config, s).get('video_transport') == 'websocket' for s in stream_ids(config)):
+        return
+    with video_socket_lock:
+        if video_socket_server is None:
+            video_socket_server = video_socket.start_video_socket(get_pipeline, port=VIDEO_SOCKET_PORT)
+
+
+def default_stream_id():
+    return stream_ids(get_config())[0]
+
+
+def get_pipeline(stream_id):
+    """Return the pipeline for a configured stream, creating it (without opening the device) on first use."""
+    config = get_config()
+    if stream_id not in stream_ids(config):
+        abort(404, f"Unknown stream {stream_id!r}")
+    with pipelines_lock:
+        pipeline = pipelines.get(stream_id)
+        if pipeline is None:
+            settings = stream_settings(config, stream_id)
+            # Resolved from the cached inventory, nothing is opened here
+            if settings.get('camera') == SYNTHETIC_CAMERA:
+                camera_index = SYNTHETIC_CAMERA
+                modes = []
+            else:
+                camera_index = get_video_output.select_camera_index(settings.get('camera'), default=CAMERA_INDEX)
+                modes = get_video_output.device_capabilities(camera_index)
+            # "capture_process": true moves capture/encode out of this process (and its GIL)
+            pipeline_class = ProcessCapturePipeline if settings.get('capture_process') else CapturePipeline
+            pipeline = pipeline_class(stream_id, camera_index, settings,
+                                       target_fps=TARGET_FPS, jpeg_quality=JPEG_QUALITY,
+                                       idle_timeout=settings.get('idle_timeout', IDLE_TIMEOUT),
+                                       buffer_size=BUFFER_SIZE, modes=modes)
+            pipelines[stream_id] = pipeline
+            print(f"Created pipeline for stream {stream_id!r} (camera index {camera_index})")
+        return pipeline
 
-def capture_frames():
+
+def camera_manager():
     """
-    Optimized frame capture loop that runs in a background thread.
+    A thread that manages the camera resources.
+    Each pipeline starts its camera when its first viewer connects and stops it when the last one leaves.
     """
-    global latest_frame, camera
-    
-    frame_interval = 1.0 / TARGET_FPS
-    last_frame_time = 0
-    
     while True:
-        with camera_lock:
-            if not camera:
-                time.sleep(0.1)
-                continue
-
-        current_time = time.time()
-        
-        # Control frame rate
-        if current_time - last_frame_time < frame_interval:
-            time.sleep(0.001)  # Very short sleep to prevent CPU spinning
-            continue
-            
-        ret, frame = camera.read()
-        
-        if ret:
-            config = get_config()
-            if config['flip_camera']:
-                frame = cv2.flip(frame, 1)
-            # Encode frame to JPEG
-            encode_params = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
-            _, buffer = cv2.imencode('.jpg', frame, encode_params)
-            frame_bytes = buffer.tobytes()
-            
-            # Update latest frame (thread-safe)
-            latest_frame = frame_bytes
-            
-            # Add to queue, removing old frames if queue is full
-            if frame_queue.full():
-                try:
-                    frame_queue.get_nowait()  # Remove oldest frame
-                except:
-                    pass
-            
+        with pipelines_lock:
+            current = list(pipelines.values())
+        for pipeline in current:
+            # One broken stream mustn't stop idle shutdown and restarts for the others
             try:
-                frame_queue.put_nowait(frame_bytes)
-            except:
-                pass  # Queue might be full, skip this frame
-                
-            last_frame_time = current_time
-        else:
-            print("Failed to read frame from camera.")
-            time.sleep(0.1)
-
-def initialize_camera():
-    """Initializes the camera with optimized settings."""
-    global camera, capture_thread
-    config = get_config()
-    width, height = map(int, config['resolution'].split('x'))
-    
-    with camera_lock:
-        if camera is None:
-            print(f"Initializing camera (index: {CAMERA_INDEX})...")
-            camera = cv2.VideoCapture(CAMERA_INDEX)
-            
-            if not camera.isOpened():
-                print(f"Error: Could not open camera {CAMERA_INDEX}.")
-                camera = None
-                return False
-            
-            # Optimize camera settings for low latency
-            print("Setting camera properties")
-            print(f"Camera resolution: {width}x{height}")
-            camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Reduce internal buffer
-            camera.set(cv2.CAP_PROP_FPS, TARGET_FPS)
-            camera.set(cv2.CAP_PROP_FRAME_WIDTH, width)
-            camera.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
-            
-            print("Camera initialized successfully.")
-
-            # Start the capture thread
-            if capture_thread is None or not capture_thread.is_alive():
-                capture_thread = threading.Thread(target=capture_frames, daemon=True)
-                capture_thread.start()
-                
-    return True
-
-def generate_frames():
-    """
-    Optimized generator function that yields the latest frames.
-    """
-    global last_access_time, active_viewers
-
-    # Increment viewer count
-    with viewer_lock:
-        active_viewers += 1
-    
-    if not initialize_camera():
-        # Decrement viewer count if initialization fails
-        with viewer_lock:
-            active_viewers -= 1
-        return
+                pipeline.tick()
+            except Exception as e:
+                print(f"[{pipeline.stream_id}] Error in camera manager: {e}")
+        time.sleep(1)
 
-    print(f"Viewer connected. Total viewers: {active_viewers}")
-    
-    try:
-        while True:
-            last_access_time = time.time()
-            
-            # Get the latest frame
-            if latest_frame:
-                yield (
-                    b'--frame\r\n'
-                    b'Content-Type: image/jpeg\r\n\r\n' + 
-                    latest_frame +
-                    b'\r\n'
-                )
-            
-            # Small sleep to prevent overwhelming the client
-            time.sleep(1.0 / TARGET_FPS)
-            
-    except GeneratorExit:
-        # Client disconnected
-        pass
-    finally:
-        # Decrement viewer count
-        with viewer_lock:
-            active_viewers -= 1
-        print(f"Viewer disconnected. Total viewers: {active_viewers}")
+
+def close_pipelines():
+    with pipelines_lock:
+        for pipeline in pipelines.values():
+            pipeline.close()
 
 @app.route('/')
 def index():
@@ -207,34 +118,80 @@ def index():
 def list_plugins():
     return jsonify(loaded_plugins)
 
+def render_stream_page(template, stream_id):
+    pipeline = get_pipeline(stream_id)
+    config = get_config()
+    # Falls back to MJPEG when the WebSocket server isn't running
+    use_socket = video_socket_server is not None and pipeline.settings.get('video_transport') == 'websocket'
+    return render_template(template, camera_name=f"{CAMERA_NAME} ({stream_id})" if len(stream_ids(config)) > 1 else CAMERA_NAME,
+                           show_text=pipeline.settings['show_text'], broadcast_resolution=pipeline.broadcast_resolution(),
+                           feed_url=f"/streams/{stream_id}/video_feed", status_url=f"/streams/{stream_id}/status",
+                           stream_id=stream_id, video_socket_port=VIDEO_SOCKET_PORT if use_socket else None,
+                           hid_address=pipeline.settings.get('hid_address'))
+
+
 @app.route('/video-only')
 def show_video():
     """Render the main streaming page."""
-    global camera
-    config = get_config()
-    width = "0"
-    height = "0"
-    fps = "0"
-    if camera: 
-        width  = int(camera.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(camera.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = camera.get(cv2.CAP_PROP_FPS)
-    return render_template("templates/index.html", camera_name=CAMERA_NAME, show_text=config['show_text'], broadcast_resolution=f"{width}x{height}@{fps}")
+    return render_stream_page("templates/index.html", default_stream_id())
 
 
 @app.route('/video-control')
 def show_video_better_main():
     """Render the main streaming page."""
-    global camera
+    return render_stream_page("templates/index-with-passthrough-main.html", default_stream_id())
+
+
+@app.route('/streams')
+def list_streams():
     config = get_config()
-    width = "0"
-    height = "0"
-    fps = "0"
-    if camera: 
-        width  = int(camera.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(camera.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = camera.get(cv2.CAP_PROP_FPS)
-    return render_template("templates/index-with-passthrough-main.html", camera_name=CAMERA_NAME, show_text=config['show_text'], broadcast_resolution=f"{width}x{height}@{fps}")
+    streams = []
+    for stream_id in stream_ids(config):
+        pipeline = pipelines.get(stream_id)
+        streams.append({
+            'id': stream_id,
+            'active': bool(pipeline and pipeline.is_running()),
+            'viewers': pipeline.active_viewers if pipeline else 0,
+            'video_feed': f"/streams/{stream_id}/video_feed",
+        })
+    return jsonify(streams)
+
+
+@app.route('/streams/<stream_id>/video-only')
+def show_stream_video(stream_id):
+    return render_stream_page("templates/index.html", stream_id)
+
+
+@app.route('/streams/<stream_id>/video-control')
+def show_stream_video_control(stream_id):
+    return render_stream_page("templates/index-with-passthrough-main.html", stream_id)
+
+
+@app.route('/streams/<stream_id>/video_feed')
+def stream_video_feed(stream_id):
+    """The video streaming route for one capture device. ?roi=x,y,w,h (fractions of the frame) zooms in."""
+    pipeline = get_pipeline(stream_id)
+    try:
+        roi = parse_roi(request.args.get('roi'))
+    except ValueError as e:
+        abort(400, f"Invalid roi: {e}")
+    return Response(pipeline.generate_frames(roi=roi), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+
+@app.route('/streams/<stream_id>/status')
+def stream_status(stream_id):
+    return jsonify(get_pipeline(stream_id).status())
+
+
+@app.route('/streams/<stream_id>/screenshot')
+def stream_screenshot(stream_id):
+    pipeline = get_pipeline(stream_id)
+    if pipeline.active_viewers == 0:
+        return "No one is viewing right now.", 404
+    frame = pipeline.get_latest_frame()
+    if frame:
+        return Response(frame, mimetype='image/jpeg')
+    return "No frame available yet.", 404
 
 def get_config():
     try:
@@ -258,29 +215,108 @@ def save_config(config):
     with open('config.json', 'w') as f:
         json.dump(config, f, indent=4)
 
+# Offered on the settings page until the device's modes have been probed (tuned for the EVGA XR1 Lite)
+FALLBACK_RESOLUTIONS = [('1280x720', '1280x720 (720p, 16:9)'), ('720x480', '720x480 (480p, 16:9)'),
+                        ('720x576', '720x576 (576p, 16:9)'), ('640x480', '640x480 (VGA, 4:3)')]
+
+
+def resolution_options(pipeline):
+    """(value, label) for each resolution the device supports, largest first, with its measured performance."""
+    if not pipeline.modes:
+        return FALLBACK_RESOLUTIONS
+    options = []
+    sizes = sorted({(m['width'], m['height']) for m in pipeline.modes}, key=lambda s: s[0] * s[1], reverse=True)
+    for width, height in sizes:
+        value = f"{width}x{height}"
+        pixel_format = choose_mode({'resolution': value}, pipeline.modes,
+                                   demand_fps(pipeline.settings, pipeline.target_fps))[0]
+        mode = next(m for m in pipeline.modes if m['format'] == pixel_format and m['width'] == width
+                    and m['height'] == height)
+        options.append((value, f"{value} ({mode['format']}, {mode['measured_fps']:g} fps measured, "
+                               f"{mode['decode_ms']:g} ms decode)"))
+    return options
+
+
 @app.route('/settings')
 def settings():
     config = get_config()
-    return render_template('templates/settings_capture_card.html', config=config,current_resolution=config["resolution"])
-
-REINIT_CAMERA = False
+    stream_id = request.args.get('stream', default_stream_id())
+    if stream_id not in stream_ids(config):
+        abort(404, f"Unknown stream {stream_id!r}")
+    settings = stream_settings(config, stream_id)
+    pipeline = get_pipeline(stream_id)
+    auto_settings = dict(settings, resolution=AUTO_MODE)
+    return render_template('templates/settings_capture_card.html', config=settings,
+                           current_resolution=pipeline.broadcast_resolution() if pipeline.is_running() else "not streaming",
+                           requested_mode=pipeline.requested_mode(), resolutions=resolution_options(pipeline),
+                           auto_mode=format_mode(*choose_mode(auto_settings, pipeline.modes,
+                                                              demand_fps(settings, pipeline.target_fps))),
+                           adaptive={key: adaptive_setting(settings, key) for key in ADAPTIVE_DEFAULTS},
+                           probed=bool(pipeline.modes), probe_error=request.args.get('probe_error'),
+                           video_socket_available=video_socket_server is not None,
+                           stream_id=stream_id, streams=stream_ids(config), hid_address=settings.get('hid_address'),
+                           jpeg_quality=settings.get('jpeg_quality', JPEG_QUALITY))
+
+
+@app.route('/streams/<stream_id>/probe_modes', methods=['POST'])
+def probe_stream_modes(stream_id):
+    """Measure the device's modes for the settings page. Takes a second or so per mode."""
+    pipeline = get_pipeline(stream_id)
+    if pipeline.camera_index == SYNTHETIC_CAMERA:
+        error = "the synthetic camera has nothing to probe"
+    elif pipeline.is_running():
+        error = "close the video pages first, the device can't be measured while streaming"
+    elif not pipeline.probe_modes():
+        error = "no modes found, check the server log"
+    else:
+        error = None
+    if error:
+        return redirect(f'/settings?stream={stream_id}&probe_error={quote(error)}')
+    return redirect(f'/settings?stream={stream_id}')
+
+def form_int(name, fallback):
+    """Integer form field, keeping the current value when it's empty or not a number."""
+    try:
+        return int(request.form.get(name, fallback))
+    except ValueError:
+        return fallback
 
 @app.route('/save_settings', methods=['POST'])
 def save_settings():
-    global REINIT_CAMERA
     config = get_config()
-    config['resolution'] = request.form.get('resolution', config['resolution'])
-    config['flip_camera'] = request.form.get('flip_camera') == 'true'
-    config['show_text'] = request.form.get('show_text') == 'true'
-    config['unlocked_scaling'] = request.form.get('unlocked_scaling') == 'true'
+    stream_id = request.form.get('stream', default_stream_id())
+    if stream_id not in stream_ids(config):
+        abort(404, f"Unknown stream {stream_id!r}")
+    # Streams listed under "streams" keep their own overrides, otherwise edit the top level
+    target = config['streams'][stream_id] if config.get('streams') else config
+    current = stream_settings(config, stream_id)
+    target['resolution'] = request.form.get('resolution', current['resolution'])
+    target['flip_camera'] = request.form.get('flip_camera') == 'true'
+    target['show_text'] = request.form.get('show_text') == 'true'
+    target['unlocked_scaling'] = request.form.get('unlocked_scaling') == 'true'
+    if request.form.get('video_transport') in ('mjpeg', 'websocket'):
+        target['video_transport'] = request.form['video_transport']
+    target['jpeg_quality'] = max(10, min(100, form_int('jpeg_quality', current.get('jpeg_quality', JPEG_QUALITY))))
+    target['adaptive'] = request.form.get('adaptive') == 'true'
+    target['min_fps'] = max(1, min(120, form_int('min_fps', adaptive_setting(current, 'min_fps'))))
+    target['max_fps'] = max(target['min_fps'], min(120, form_int('max_fps', adaptive_setting(current, 'max_fps'))))
+    target['min_quality'] = max(10, min(target['jpeg_quality'], form_int('min_quality', adaptive_setting(current, 'min_quality'))))
+    target['bitrate_kbps'] = max(0, form_int('bitrate_kbps', adaptive_setting(current, 'bitrate_kbps')))
     save_config(config)
-    REINIT_CAMERA = True
-    return redirect('/settings')
+    start_video_socket_if_used(config)
+
+    # Top-level changes apply to every stream that doesn't override them.
+    # Pipelines only touch the device for resolution changes, see capture_pipeline.classify_settings
+    with pipelines_lock:
+        for pipeline_id, pipeline in pipelines.items():
+            if pipeline_id == stream_id or target is config:
+                pipeline.update_settings(stream_settings(config, pipeline_id))
+    return redirect(f'/settings?stream={stream_id}')
 
 @app.route('/video_feed')
 def video_feed():
-    """The video streaming route."""
-    return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    """The video streaming route for the default stream."""
+    return stream_video_feed(default_stream_id())
 
 def load_plugins(app):
     global loaded_plugins
@@ -294,8 +330,9 @@ def load_plugins(app):
             try:
                 module = importlib.import_module(module_name)
                 if hasattr(module, "register"):
-                    # Pass a function to get the latest frame and active viewers
-                    module.register(app, lambda: latest_frame, lambda: active_viewers)
+                    # Pass a function to get the latest frame and active viewers of the default stream
+                    module.register(app, lambda: get_pipeline(default_stream_id()).get_latest_frame(),
+                                    lambda: get_pipeline(default_stream_id()).active_viewers)
                     loaded_plugins.append(filename)
                     print(f"Loaded plugin: {filename}")
             except Exception as e:
@@ -309,10 +346,16 @@ if __name__ == '__main__':
     # Load plugins
     load_plugins(app)
 
+    print(f"Streams: {', '.join(stream_ids(get_config()))}")
+
+    atexit.register(close_pipelines)
+
     # Start the camera manager thread
     manager_thread = threading.Thread(target=camera_manager, daemon=True)
     manager_thread.start()
 
+    start_video_socket_if_used(get_config())
+
     print("=====================================")
     print(f"  {CAMERA_NAME} - Web Streamer")
     print("=====================================")
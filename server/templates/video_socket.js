@@ -0,0 +1,66 @@
+        /* ---------------- WebSocket video (see video_socket.py) ----------------
+           Each binary message is [u32 frame id][f64 capture time][f64 send time][JPEG].
+           Frames are drawn to the canvas in order and acknowledged once drawn, the
+           server only sends more while fewer than its window are unacknowledged. */
+        const FRAME_HEADER_SIZE = 20;
+
+        class VideoSocketPlayer {
+            constructor(canvas, url, onState, onStats) {
+                this.canvas = canvas;
+                this.context = canvas.getContext('2d');
+                this.url = url;
+                this.onState = onState;
+                this.onStats = onStats;
+                this.ws = null;
+                this.roi = null;
+                this.drawing = Promise.resolve();
+                this.reconnectDelay = 500;
+            }
+
+            connect(roi) {
+                this.roi = roi || null;
+                if (this.ws) {
+                    this.ws.onclose = null;
+                    this.ws.close();
+                }
+                const ws = new WebSocket(this.roi ? `${this.url}?roi=${this.roi}` : this.url);
+                ws.binaryType = 'arraybuffer';
+                ws.onopen = () => { this.reconnectDelay = 500; };
+                ws.onmessage = (event) => {
+                    if (typeof event.data === 'string') {
+                        const message = JSON.parse(event.data);
+                        if (message.type === 'stats') this.onStats(message);
+                        return;
+                    }
+                    // Chain draws so frames are shown (and acked) in the order they arrived
+                    this.drawing = this.drawing.then(() => this.draw(ws, event.data));
+                };
+                ws.onclose = () => {
+                    this.onState(false);
+                    setTimeout(() => this.connect(this.roi), this.reconnectDelay);
+                    this.reconnectDelay = Math.min(this.reconnectDelay * 2, 5000);
+                };
+                this.ws = ws;
+            }
+
+            async draw(ws, buffer) {
+                const frameId = new DataView(buffer).getUint32(0, true);
+                try {
+                    const blob = new Blob([new Uint8Array(buffer, FRAME_HEADER_SIZE)], { type: 'image/jpeg' });
+                    const bitmap = await createImageBitmap(blob);
+                    if (this.canvas.width !== bitmap.width || this.canvas.height !== bitmap.height) {
+                        this.canvas.width = bitmap.width;
+                        this.canvas.height = bitmap.height;
+                    }
+                    this.context.drawImage(bitmap, 0, 0);
+                    bitmap.close();
+                    this.onState(true);
+                } catch (e) {
+                    console.warn('Dropped undecodable frame', frameId, e);
+                }
+                // Ack even a bad frame, otherwise the window never reopens
+                if (ws.readyState === WebSocket.OPEN) {
+                    ws.send(JSON.stringify({ ack: frameId }));
+                }
+            }
+        }
@@ -0,0 +1,164 @@
+"""
+WebSocket video transport with client-acknowledged flow control.
+
+MJPEG over HTTP gives the server no idea when the browser has actually shown a
+frame, so on a slow link frames pile up in TCP and browser buffers and the picture
+falls further and further behind. Here every JPEG goes out as one binary message:
+
+  [u32 frame id][f64 capture time][f64 send time][JPEG bytes]   (little endian)
+
+and the page answers {"ack": id} once it has drawn it. Each viewer has at most
+`window` frames unacknowledged; when the window opens the newest frame is sent and
+anything captured in between is skipped, so the lag stays bounded by
+window x round trip. About once a second the server sends a text message with the
+viewer's stats: {"type": "stats", "rtt_ms", "age_ms", "fps", "skipped", "window"}.
+
+Connect to ws://host:VIDEO_SOCKET_PORT/streams/<id>/video[?roi=x,y,w,h&window=K].
+Runs on its own port next to Flask using the websockets package (already needed by
+zerohidserver); without it server.py keeps serving MJPEG only.
+"""
+
+import json
+import struct
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from capture_pipeline import parse_roi
+
+FRAME_HEADER = struct.Struct("<Idd")
+DEFAULT_WINDOW = 2  # Frames in flight per viewer, 1 = strict stop-and-wait
+MAX_WINDOW = 8
+STATS_INTERVAL = 1.0
+
+
+class ViewerStats:
+    """Round trip and frame age of one viewer, averaged over the last STATS_INTERVAL."""
+
+    def __init__(self, window):
+        self.window = window
+        self.reset()
+        self.skipped = 0
+
+    def reset(self):
+        self.started = time.time()
+        self.sent = 0
+        self.acked = 0
+        self.rtt_total = 0.0
+        self.age_total = 0.0
+
+    def ack(self, sent, captured, now):
+        rtt = now - sent
+        self.acked += 1
+        self.rtt_total += rtt
+        # Capture to screen: time queued here plus roughly half the round trip
+        self.age_total += (sent - captured) + rtt / 2
+
+    def message(self, in_flight):
+        elapsed = max(time.time() - self.started, 1e-6)
+        acked = max(self.acked, 1)
+        return json.dumps({'type': 'stats', 'rtt_ms': round(self.rtt_total / acked * 1000, 1),
+                           'age_ms': round(self.age_total / acked * 1000, 1),
+                           'fps': round(self.acked / elapsed, 1), 'skipped': self.skipped,
+                           'in_flight': in_flight, 'window': self.window})
+
+
+def parse_request(path):
+    """Returns (stream id, roi, window) from the connection path, or raises ValueError."""
+    url = urlsplit(path)
+    parts = url.path.strip('/').split('/')
+    if len(parts) != 3 or parts[0] != 'streams' or parts[2] != 'video':
+        raise ValueError(f"Unknown path {url.path!r}")
+    query = parse_qs(url.query)
+    roi = parse_roi(query.get('roi', [''])[0])
+    window = int(query.get('window', [DEFAULT_WINDOW])[0])
+    return parts[1], roi, min(max(window, 1), MAX_WINDOW)
+
+
+def stream_to_viewer(ws, pipeline, roi, window):
+    """Send frames to one connected viewer until it disconnects."""
+    from websockets.exceptions import ConnectionClosed
+
+    in_flight = {}  # frame id -> (send time, capture time)
+    frame_id = 0
+    last_seq = None
+    stats = ViewerStats(window)
+    try:
+        while True:
+            pipeline.last_access_time = time.time()
+            if len(in_flight) < window:
+                seq, captured, frame = pipeline.get_latest()
+                if roi and frame is not None and seq != last_seq:
+                    raw_seq, raw = pipeline.get_latest_raw()
+                    if raw is not None:
+                        seq, frame = raw_seq, pipeline.encode_roi(raw, roi)
+                if frame is not None and seq != last_seq:
+                    if last_seq is not None and seq > last_seq + 1:
+                        stats.skipped += seq - last_seq - 1
+                    frame_id = (frame_id + 1) & 0xFFFFFFFF
+                    sent = time.time()
+                    ws.send(FRAME_HEADER.pack(frame_id, captured or sent, sent) + frame)
+                    in_flight[frame_id] = (sent, captured or sent)
+                    last_seq = seq
+                    stats.sent += 1
+
+            # Window open: poll for the next frame. Full: nothing to do until the viewer acks
+            if len(in_flight) < window:
+                timeout = min(0.5 / max(pipeline.current_fps(), 1), 0.02)
+            else:
+                timeout = STATS_INTERVAL
+            try:
+                message = ws.recv(timeout=timeout)
+            except TimeoutError:
+                message = None
+            if message is not None and not isinstance(message, bytes):
+                try:
+                    acked = json.loads(message).get('ack')
+                except (ValueError, AttributeError):
+                    acked = None
+                if acked in in_flight:
+                    sent, captured = in_flight.pop(acked)
+                    stats.ack(sent, captured, time.time())
+
+            if time.time() - stats.started >= STATS_INTERVAL:
+                ws.send(stats.message(len(in_flight)))
+                stats.reset()
+    except ConnectionClosed:
+        pass
+
+
+def start_video_socket(resolve_pipeline, host='0.0.0.0', port=5002):
+    """
+    Serve the WebSocket video endpoint from a background thread. resolve_pipeline(stream id)
+    returns the CapturePipeline or raises for unknown streams. Returns the server, or None
+    if the websockets package isn't installed or the port is taken.
+    """
+    try:
+        from websockets.sync.server import serve
+    except ImportError:
+        print("websockets is not installed, WebSocket video disabled (pip install websockets)")
+        return None
+
+    def handler(ws):
+        try:
+            stream_id, roi, window = parse_request(ws.request.path)
+            pipeline = resolve_pipeline(stream_id)
+        except Exception as e:
+            ws.close(1008, str(e)[:100])
+            return
+        if not pipeline.add_viewer():
+            ws.close(1011, "Could not open the capture device")
+            return
+        try:
+            stream_to_viewer(ws, pipeline, roi, window)
+        finally:
+            pipeline.remove_viewer()
+
+    try:
+        server = serve(handler, host, port, compression=None)
+    except OSError as e:
+        print(f"Could not start WebSocket video on port {port} ({e}), pages fall back to MJPEG")
+        return None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"WebSocket video: ws://{host}:{port}/streams/<id>/video")
+    return server